@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+"""
+进程池/线程池基准测试，对比WorkProcPoolLinux、WorkThreadPoolWindows和multiprocessing.Pool。
+
+场景：
+    tiny       极小任务逐个提交的吞吐
+    tiny-map   极小任务通过map(自适应分块)批量执行的吞吐
+    payload    大参数(8MB bytes)传输，对比管道与共享内存
+    skewed     耗时不均的任务(5%的任务耗时是其余的20倍)
+    search     提前终止的查找(命中后取消剩余任务)
+    crash      执行中子进程崩溃后的恢复
+
+每个场景输出 tasks/s 和单任务(提交到拿到结果)延迟的p50/p99，
+search场景输出找到目标的耗时。用法：
+    python pool/benchmark.py
+    python pool/benchmark.py --scenarios tiny,payload --workers 8 --scale 2
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import multiprocessing
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pool.process_pool import LatencyHistogram
+from pool.process_pool import WorkProcPoolLinux
+from pool.process_pool import WorkThreadPoolWindows
+
+SEARCH_TARGET = 3000
+PAYLOAD_SIZE = 8 << 20
+
+
+def _noop(x):
+    return x
+
+
+def _payload_len(data):
+    return len(data)
+
+
+def _skewed(x):
+    time.sleep(0.02 if x % 20 == 0 else 0.001)
+    return x
+
+
+def _is_target(x):
+    time.sleep(0.0005)
+    return x == SEARCH_TARGET
+
+
+def _crashy(x):
+    if x % 40 == 39:
+        os._exit(1)
+    time.sleep(0.001)
+    return x
+
+
+def _make_pool(kind, workers):
+    """
+    创建被测的池
+    :param kind: workproc / workproc-shm / workthread / mp
+    :param workers:
+    :return:
+    """
+    if kind == 'workproc':
+        return WorkProcPoolLinux(workers)
+    if kind == 'workproc-shm':
+        return WorkProcPoolLinux(workers, transport='shm')
+    if kind == 'workthread':
+        return WorkThreadPoolWindows(workers)
+    if kind == 'mp':
+        return multiprocessing.Pool(workers)
+    raise ValueError(u"未知的池类型[%s]" % kind)
+
+
+def _close_pool(kind, pool):
+    if kind == 'mp':
+        pool.terminate()
+        pool.join()
+    else:
+        pool.shutdown(wait=True, cancel_pending=True)
+
+
+def _run_submit(kind, pool, func, args_list):
+    """
+    逐个提交任务，统计吞吐和单任务延迟
+    :param kind:
+    :param pool:
+    :param func:
+    :param args_list: 每个任务的参数tuple
+    :return: (成功数, 失败数, 耗时, LatencyHistogram)
+    """
+    hist = LatencyHistogram()
+    lock = threading.Lock()
+    finished = threading.Semaphore(0)
+    failed = [0]
+
+    def done(submitted_at, ok):
+        with lock:
+            if ok:
+                hist.record(time.time() - submitted_at)
+            else:
+                failed[0] += 1
+        finished.release()
+
+    start = time.time()
+    for args in args_list:
+        submitted_at = time.time()
+        if kind == 'mp':
+            pool.apply_async(func, args, callback=lambda r, t=submitted_at: done(t, True))
+        else:
+            future = pool.submit(func, *args)
+            future.add_done_callback(
+                lambda f, t=submitted_at: done(t, not f.cancelled() and f.exception() is None))
+    for _ in args_list:
+        finished.acquire()
+    return hist.count, failed[0], time.time() - start, hist
+
+
+def bench_tiny(kind, workers, scale):
+    count = int(20000 * scale)
+    pool = _make_pool(kind, workers)
+    try:
+        return _run_submit(kind, pool, _noop, [(i,) for i in range(count)])
+    finally:
+        _close_pool(kind, pool)
+
+
+def bench_tiny_map(kind, workers, scale):
+    count = int(1000000 * scale)
+    pool = _make_pool(kind, workers)
+    try:
+        start = time.time()
+        if kind == 'mp':
+            results = pool.map(_noop, range(count), chunksize=max(1, count // (workers * 4)))
+        else:
+            results = pool.map(_noop, range(count))
+        elapsed = time.time() - start
+        assert len(results) == count
+        return count, 0, elapsed, None
+    finally:
+        _close_pool(kind, pool)
+
+
+def bench_payload(kind, workers, scale):
+    count = max(1, int(40 * scale))
+    payload = b'x' * PAYLOAD_SIZE
+    pool = _make_pool(kind, workers)
+    try:
+        return _run_submit(kind, pool, _payload_len, [(payload,)] * count)
+    finally:
+        _close_pool(kind, pool)
+
+
+def bench_skewed(kind, workers, scale):
+    count = int(2000 * scale)
+    pool = _make_pool(kind, workers)
+    try:
+        return _run_submit(kind, pool, _skewed, [(i,) for i in range(count)])
+    finally:
+        _close_pool(kind, pool)
+
+
+def bench_search(kind, workers, scale):
+    count = int(1000000 * scale)
+    pool = _make_pool(kind, workers)
+    try:
+        start = time.time()
+        if kind == 'mp':
+            found = None
+            for hit in pool.imap_unordered(_is_target, range(count), chunksize=64):
+                if hit:
+                    found = SEARCH_TARGET
+                    break
+        else:
+            found = pool.find_first(_is_target, range(count))
+        elapsed = time.time() - start
+        assert found == SEARCH_TARGET
+        return SEARCH_TARGET, 0, elapsed, None
+    finally:
+        _close_pool(kind, pool)
+
+
+def bench_crash(kind, workers, scale):
+    if kind == 'mp':
+        # multiprocessing.Pool中执行任务的子进程退出后，该任务的结果永远不会返回
+        return None
+    count = int(2000 * scale)
+    pool = _make_pool(kind, workers)
+    try:
+        return _run_submit(kind, pool, _crashy, [(i,) for i in range(count)])
+    finally:
+        _close_pool(kind, pool)
+
+
+SCENARIOS = [
+    ('tiny', bench_tiny, ('workproc', 'workthread', 'mp')),
+    ('tiny-map', bench_tiny_map, ('workproc', 'workthread', 'mp')),
+    ('payload', bench_payload, ('workproc', 'workproc-shm', 'mp')),
+    ('skewed', bench_skewed, ('workproc', 'workthread', 'mp')),
+    ('search', bench_search, ('workproc', 'workthread', 'mp')),
+    ('crash', bench_crash, ('workproc', 'mp')),
+]
+
+
+def _fmt_ms(seconds):
+    return '-' if seconds is None else '%.3f' % (seconds * 1000)
+
+
+def main():
+    """
+    解析参数并依次运行各场景
+    :return:
+    """
+    parser = argparse.ArgumentParser(description=u"进程池基准测试")
+    parser.add_argument('--scenarios', default=','.join(name for name, _, _ in SCENARIOS),
+                        help=u"逗号分隔的场景名")
+    parser.add_argument('--pools', default='', help=u"逗号分隔的池类型，默认为场景支持的全部")
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--scale', type=float, default=1.0, help=u"任务数量倍数")
+    args = parser.parse_args()
+
+    scenarios = set(args.scenarios.split(','))
+    pools = set(filter(None, args.pools.split(',')))
+    print('%-10s %-14s %10s %8s %12s %10s %10s' % (
+        'scenario', 'pool', 'tasks', 'failed', 'tasks/s', 'p50(ms)', 'p99(ms)'))
+    for name, bench, kinds in SCENARIOS:
+        if name not in scenarios:
+            continue
+        for kind in kinds:
+            if pools and kind not in pools:
+                continue
+            result = bench(kind, args.workers, args.scale)
+            if result is None:
+                print('%-10s %-14s %10s' % (name, kind, 'n/a'))
+                continue
+            done, failed, elapsed, hist = result
+            if name == 'search':
+                print('%-10s %-14s %10d %8s %12s %10s %10s  found in %.3fs' % (
+                    name, kind, done, '-', '-', '-', '-', elapsed))
+                continue
+            print('%-10s %-14s %10d %8d %12.1f %10s %10s' % (
+                name, kind, done, failed, (done + failed) / elapsed,
+                _fmt_ms(hist.percentile(50) if hist else None),
+                _fmt_ms(hist.percentile(99) if hist else None)))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
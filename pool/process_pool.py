@@ -4,17 +4,1214 @@
 """
 import os
 import sys
+import errno
+import select
 import signal
 import time
+import itertools
+import json
+import math
+import heapq
+import mmap
+import tempfile
+import functools
+import collections
+import traceback
 import threading
 import multiprocessing
 from multiprocessing import Pool
 
 import logging
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import asyncio
+except ImportError:  # python2
+    asyncio = None
+
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 
+# 0.任务分发模式的公共组件
+class PoolClosedError(Exception):
+    """
+    进程池已关闭，不再接受新任务
+    """
+    pass
+
+
+class PoolBusyError(Exception):
+    """
+    在途任务数已达到max_inflight，调用方可稍后重试
+    """
+    pass
+
+
+class DeadlineExceededError(Exception):
+    """
+    任务开始执行前已超过其deadline，不再执行
+    """
+    pass
+
+
+class WorkerLostError(Exception):
+    """
+    执行任务的子进程异常退出
+    """
+    pass
+
+
+class TaskCancelledError(Exception):
+    """
+    任务在开始执行前被取消
+    """
+    pass
+
+
+class RemoteTaskError(Exception):
+    """
+    子进程中抛出的异常无法序列化时，以此异常携带其traceback返回
+    """
+    pass
+
+
+class TaskFuture(object):
+    """
+    任务句柄，submit返回该对象，用于等待、获取或取消任务的执行结果
+    """
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    CANCELLED = 'CANCELLED'
+    FINISHED = 'FINISHED'
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._state = self.PENDING
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._submitted_at = time.time()
+        self._started_at = None  # 开始执行(分发给子进程)的时间
+        self._finished_at = None
+
+    def cancel(self):
+        """
+        取消尚未开始执行的任务
+        :return: True: 取消成功, False: 任务已开始或已结束
+        """
+        with self._cond:
+            if self._state == self.CANCELLED:
+                return True
+            if self._state != self.PENDING:
+                return False
+            self._state = self.CANCELLED
+            self._cond.notify_all()
+        self._run_callbacks()
+        return True
+
+    def cancelled(self):
+        return self._state == self.CANCELLED
+
+    def running(self):
+        return self._state == self.RUNNING
+
+    def done(self):
+        return self._state in (self.CANCELLED, self.FINISHED)
+
+    def result(self, timeout=None):
+        """
+        等待并返回任务结果，任务抛出的异常会在此处重新抛出
+        :param timeout: 超时时间(秒)，None表示一直等待
+        :return:
+        """
+        self._wait(timeout)
+        if self._state == self.CANCELLED:
+            raise TaskCancelledError()
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        等待任务结束并返回其抛出的异常，正常结束时返回None
+        :param timeout: 超时时间(秒)，None表示一直等待
+        :return:
+        """
+        self._wait(timeout)
+        if self._state == self.CANCELLED:
+            raise TaskCancelledError()
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """
+        任务结束(完成、失败或取消)时调用fn(future)，若已结束则立即调用
+        :param fn:
+        :return:
+        """
+        with self._cond:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_running(self):
+        """
+        标记任务开始执行
+        :return: False表示任务已被取消或已结束(如超过deadline)，不应再执行
+        """
+        with self._cond:
+            if self._state != self.PENDING:
+                return False
+            self._state = self.RUNNING
+            self._started_at = time.time()
+            return True
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _finish(self, result, exception):
+        with self._cond:
+            if self.done():
+                return
+            self._result = result
+            self._exception = exception
+            self._state = self.FINISHED
+            self._finished_at = time.time()
+            self._cond.notify_all()
+        self._run_callbacks()
+
+    def _wait(self, timeout):
+        with self._cond:
+            if timeout is None:
+                while not self.done():
+                    self._cond.wait()
+            else:
+                deadline = time.time() + timeout
+                while not self.done():
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise multiprocessing.TimeoutError()
+                    self._cond.wait(remaining)
+
+    def _run_callbacks(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                logging.error(u"执行任务回调失败[%s]" % e)
+
+
+def _iter_chunks(iterable, chunksize):
+    """
+    将iterable按chunksize切分成list，惰性生成
+    :param iterable:
+    :param chunksize:
+    :return:
+    """
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _run_chunk(func, chunk):
+    """
+    在工作进程中依次执行一个分块内的所有元素
+    :param func:
+    :param chunk:
+    :return: (执行耗时, 结果list)
+    """
+    start = time.time()
+    results = [func(item) for item in chunk]
+    return time.time() - start, results
+
+
+def _find_in_chunk(predicate, chunk, negate=False):
+    """
+    在工作进程中查找分块内第一个满足predicate的元素，找到即停止
+    :param predicate:
+    :param chunk:
+    :param negate: 为True时查找第一个不满足predicate的元素
+    :return: (执行耗时, 命中元素list)
+    """
+    start = time.time()
+    for item in chunk:
+        if bool(predicate(item)) != negate:
+            return time.time() - start, [item]
+    return time.time() - start, []
+
+
+class _AdaptiveChunker(object):
+    """
+    根据实测的单元素耗时和每个分块的调度/IPC开销动态调整分块大小：
+    元素很轻时增大分块以摊薄开销，元素较重或耗时不均时减小分块以保证负载均衡
+    """
+    OVERHEAD_RATIO = 0.05  # 允许调度开销占分块耗时的比例
+    MAX_CHUNK_TIME = 0.5  # 单个分块耗时上限(秒)，避免慢任务拖长尾部
+    MAX_CHUNKSIZE = 1 << 16
+    ALPHA = 0.3  # 指数滑动平均系数
+
+    def __init__(self, workers, total=None):
+        """
+        :param workers: 工作进程/线程数
+        :param total: 输入总数，未知时为None
+        """
+        self.workers = max(1, workers)
+        self.remaining = total
+        self.chunksize = 1
+        self.item_time = None  # 单元素耗时均值
+        self.item_var = 0.0  # 单元素耗时方差
+        self.overhead = 0.0  # 每个分块的调度+IPC开销
+        self._lock = threading.Lock()
+
+    def next_size(self):
+        """
+        下一个分块的大小
+        :return:
+        """
+        with self._lock:
+            size = self.chunksize
+            if self.remaining is not None:
+                # 输入接近结束时缩小分块，让各worker同时结束
+                size = max(1, min(size, self.remaining // (4 * self.workers)))
+                self.remaining -= size
+            return size
+
+    def record(self, count, elapsed, round_trip):
+        """
+        记录一个分块的实测数据并重新计算分块大小
+        :param count: 分块内元素数
+        :param elapsed: worker内执行耗时
+        :param round_trip: 从分发到收到结果的耗时
+        :return:
+        """
+        per_item = elapsed / count
+        overhead = max(0.0, round_trip - elapsed)
+        with self._lock:
+            if self.item_time is None:
+                self.item_time = per_item
+                self.overhead = overhead
+            else:
+                diff = per_item - self.item_time
+                self.item_time += self.ALPHA * diff
+                self.item_var = (1 - self.ALPHA) * (self.item_var + self.ALPHA * diff * diff)
+                self.overhead += self.ALPHA * (overhead - self.overhead)
+            item_time = max(self.item_time, 1e-7)
+            size = self.overhead / (self.OVERHEAD_RATIO * item_time)
+            # 耗时离散度越大，分块越小
+            size /= 1.0 + math.sqrt(self.item_var) / item_time
+            size = min(size, self.MAX_CHUNK_TIME / item_time, self.chunksize * 2.0,
+                       self.MAX_CHUNKSIZE)
+            self.chunksize = int(max(1, size))
+
+
+def _dump_exception(e):
+    """
+    子进程异常序列化，无法序列化时转为RemoteTaskError
+    :param e:
+    :return:
+    """
+    tb = traceback.format_exc()
+    try:
+        return pickle.dumps(e, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return pickle.dumps(RemoteTaskError(tb), pickle.HIGHEST_PROTOCOL)
+
+
+_SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+_SHM_PREFIX = 'workpool-'
+# 可通过/proc/<pid>/fd/<fd>打开其他进程持有的已删除文件
+_PROC_FD = os.path.isdir('/proc/self/fd')
+
+
+class _ShmRef(object):
+    """
+    共享内存段句柄，大参数/结果放入共享内存后，进程间只传递该对象
+    """
+
+    def __init__(self, path, size, kind, dtype=None, shape=None):
+        self.path = path
+        self.size = size
+        self.kind = kind  # ndarray / bytes / bytearray
+        self.dtype = dtype
+        self.shape = shape
+        self.fd = None  # 段文件已删除、由创建方持有fd时，path为/proc/<pid>/fd/<fd>
+
+
+def _shm_transportable(obj, threshold):
+    """
+    是否应通过共享内存传输：连续内存的numpy数组或bytes/bytearray，且不小于threshold字节
+    :param obj:
+    :param threshold:
+    :return:
+    """
+    if numpy is not None and isinstance(obj, numpy.ndarray):
+        return not obj.dtype.hasobject and obj.nbytes >= threshold
+    return isinstance(obj, (bytes, bytearray)) and len(obj) >= threshold
+
+
+def _shm_put(obj, anonymous=False):
+    """
+    将obj写入新建的共享内存段(/dev/shm下的mmap文件)，文件名带创建进程的pid，
+    进程异常退出后遗留的段由_cleanup_stale_shm删除
+    :param obj: numpy数组或bytes/bytearray
+    :param anonymous: 写入后立即删除段文件，只保留fd，其他进程通过/proc/<pid>/fd打开；
+                      创建进程退出(包括被kill)时内核自动回收，须用_shm_close释放
+    :return: _ShmRef
+    """
+    if numpy is not None and isinstance(obj, numpy.ndarray):
+        obj = numpy.ascontiguousarray(obj)
+        ref = _ShmRef(None, obj.nbytes, 'ndarray', obj.dtype, obj.shape)
+    else:
+        ref = _ShmRef(None, len(obj), 'bytearray' if isinstance(obj, bytearray) else 'bytes')
+    fd, ref.path = tempfile.mkstemp(prefix='%s%d-' % (_SHM_PREFIX, os.getpid()), dir=_SHM_DIR)
+    anonymous = anonymous and _PROC_FD
+    try:
+        os.ftruncate(fd, ref.size)
+        mm = mmap.mmap(fd, ref.size)
+        try:
+            if ref.kind == 'ndarray':
+                view = numpy.frombuffer(mm, dtype=obj.dtype).reshape(obj.shape)
+                view[...] = obj
+                del view
+            else:
+                mm[:] = bytes(obj)
+        finally:
+            mm.close()
+    except Exception:
+        os.unlink(ref.path)
+        os.close(fd)
+        raise
+    if anonymous:
+        os.unlink(ref.path)
+        ref.path = '/proc/%d/fd/%d' % (os.getpid(), fd)
+        ref.fd = fd
+    else:
+        os.close(fd)
+    return ref
+
+
+def _shm_close(ref):
+    """
+    释放共享内存段：删除段文件，或关闭anonymous段的fd
+    :param ref: _ShmRef
+    :return:
+    """
+    try:
+        if ref.fd is not None:
+            os.close(ref.fd)
+            ref.fd = None
+        else:
+            os.unlink(ref.path)
+    except OSError:
+        pass
+
+
+def _cleanup_stale_shm():
+    """
+    删除创建进程已不存在的共享内存段，它们是进程被kill或崩溃时未能回收的段
+    :return: 删除的段文件数
+    """
+    shm_dir = _SHM_DIR or tempfile.gettempdir()
+    removed = 0
+    try:
+        names = os.listdir(shm_dir)
+    except OSError:
+        return 0
+    for name in names:
+        parts = name.split('-')
+        if not name.startswith(_SHM_PREFIX) or len(parts) < 3 or not parts[1].isdigit():
+            continue
+        try:
+            os.kill(int(parts[1]), 0)
+            continue
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                continue
+        try:
+            os.unlink(os.path.join(shm_dir, name))
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        logging.info(u"删除遗留的共享内存段[%d]" % removed)
+    return removed
+
+
+def _shm_get(ref, unlink=False):
+    """
+    映射共享内存段并还原对象；numpy数组直接引用映射内存，不做拷贝
+    :param ref: _ShmRef
+    :param unlink: 映射后是否删除段文件(接收方独占结果时使用)，映射在对象释放时回收
+    :return:
+    """
+    fd = os.open(ref.path, os.O_RDWR if unlink else os.O_RDONLY)
+    try:
+        mm = mmap.mmap(fd, ref.size, access=mmap.ACCESS_WRITE if unlink else mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+        if unlink:
+            os.unlink(ref.path)
+    if ref.kind == 'ndarray':
+        return numpy.frombuffer(mm, dtype=ref.dtype).reshape(ref.shape)
+    data = mm[:]
+    mm.close()
+    return bytearray(data) if ref.kind == 'bytearray' else data
+
+
+class _ShmArgCache(object):
+    """
+    父进程中大参数的共享内存段，按对象引用计数：
+    同一对象被多个任务使用时只写入一次，最后一个使用它的任务结束后删除
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._segments = {}  # id(obj) -> [obj, _ShmRef, 引用数]
+
+    def encode(self, args, kwargs, shared):
+        """
+        将大参数替换为_ShmRef
+        :param args:
+        :param kwargs:
+        :param shared: 输出参数，记录本次引用的对象，任务结束后需release
+        :return: (args, kwargs)
+        """
+        args = tuple(self._acquire(a, shared) for a in args)
+        kwargs = dict((k, self._acquire(v, shared)) for k, v in kwargs.items())
+        return args, kwargs
+
+    def _acquire(self, obj, shared):
+        if not _shm_transportable(obj, self.threshold):
+            return obj
+        with self._lock:
+            entry = self._segments.get(id(obj))
+            if entry is None:
+                # 父进程被kill时段随fd一起回收，不会遗留在/dev/shm
+                entry = self._segments[id(obj)] = [obj, _shm_put(obj, anonymous=True), 0]
+            entry[2] += 1
+        shared.append(obj)
+        return entry[1]
+
+    def release(self, shared, future=None):
+        """
+        任务结束后减少引用，引用归零时删除共享内存段
+        :param shared:
+        :param future:
+        :return:
+        """
+        with self._lock:
+            for obj in shared:
+                entry = self._segments.get(id(obj))
+                if entry is None:
+                    continue
+                entry[2] -= 1
+                if entry[2] <= 0:
+                    del self._segments[id(obj)]
+                    _shm_close(entry[1])
+
+
+class WorkerContext(object):
+    """
+    工作进程上下文，在worker整个生命周期内存在。initializer可以在其上挂载
+    SqliteHelper、MySQL连接、OGR驱动等昂贵资源，后续任务通过get_worker_context()复用；
+    worker被重新拉起时上下文随initializer一起重新创建
+    """
+
+    def __init__(self, worker_id=None):
+        self.pid = os.getpid()
+        self.worker_id = worker_id
+        self.tasks_done = 0
+
+
+_worker_context = [None]  # 工作进程的上下文
+_worker_local = threading.local()  # 工作线程的上下文
+
+
+def get_worker_context():
+    """
+    获取当前工作进程/工作线程的上下文
+    :return: WorkerContext，不在工作进程/线程中时返回None
+    """
+    context = getattr(_worker_local, 'context', None)
+    return context if context is not None else _worker_context[0]
+
+
+def _init_worker(initializer, initargs, worker_id=None, thread=False):
+    """
+    在工作进程/线程中创建上下文并执行initializer
+    :param initializer:
+    :param initargs:
+    :param worker_id:
+    :param thread: 是否为线程池的工作线程，线程的上下文只对本线程可见
+    :return: WorkerContext
+    """
+    context = WorkerContext(worker_id)
+    if thread:
+        _worker_local.context = context
+    else:
+        _worker_context[0] = context
+    if initializer is not None:
+        initializer(*initargs)
+    return context
+
+
+def _bootstrap_process(initializer, initargs, func, args):
+    """
+    Windows进程池子进程入口：先执行initializer再执行func
+    :param initializer:
+    :param initargs:
+    :param func:
+    :param args:
+    :return:
+    """
+    _init_worker(initializer, initargs)
+    if args is None:
+        func()
+    else:
+        func(args)
+
+
+def _private_memory():
+    """
+    当前进程独占的内存(字节)，即smaps中Private_*之和：
+    不含fork时与父进程共享、尚未写入的写时复制页
+    :return: 无法读取/proc时返回None
+    """
+    # smaps_rollup需要Linux 4.14+，更早的内核逐个映射累加
+    for path in ('/proc/self/smaps_rollup', '/proc/self/smaps'):
+        try:
+            total = 0
+            with open(path) as f:
+                for line in f:
+                    if line.startswith('Private_'):
+                        total += int(line.split()[1])
+            return total * 1024
+        except (IOError, OSError, ValueError, IndexError):
+            continue
+    return None
+
+
+def _current_rss():
+    """
+    当前进程的常驻内存(字节)，含与父进程共享的页；无法读取/proc时退化为峰值常驻内存
+    :return:
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, AttributeError):
+        return 0
+
+
+def _worker_memory(rss_baseline):
+    """
+    子进程用于回收判断的内存占用(字节)
+    :param rss_baseline: None时使用独占内存，否则为常驻内存相对该基准的增长量
+    :return:
+    """
+    if rss_baseline is None:
+        memory = _private_memory()
+        if memory is not None:
+            return memory
+        rss_baseline = 0
+    return _current_rss() - rss_baseline
+
+
+def _proc_worker_loop(conn, shm_threshold=None, max_tasks=None, max_rss=None):
+    """
+    常驻子进程的任务循环：从管道读取任务，执行后回写结果，收到None时退出。
+    每个任务结束后检查回收策略，达到max_tasks或常驻内存超过max_rss时，
+    在结果中通知父进程并退出，由父进程fork新的子进程替换
+    :param conn: 与父进程通信的管道
+    :param shm_threshold: 不为None时，不小于该字节数的结果通过共享内存返回
+    :param max_tasks: 执行多少个任务后退出，None表示不限制
+    :param max_rss: 独占内存上限(字节)，None表示不限制。fork时从父进程继承的共享页不计入；
+                    无法读取独占内存时，以进入任务循环时的常驻内存为基准计算增长量
+    :return:
+    """
+    context = get_worker_context()
+    tasks_done = 0
+    rss_baseline = None
+    if max_rss is not None and _private_memory() is None:
+        rss_baseline = _current_rss()
+    last_result = None  # 最近一次通过共享内存返回的结果，父进程映射后会删除段文件
+    while True:
+        try:
+            task = pickle.loads(conn.recv_bytes())
+        except (EOFError, IOError, OSError):
+            # 父进程已关闭管道或退出，不会再读取结果
+            if last_result is not None:
+                _shm_close(last_result)
+            return
+        if task is None:
+            return
+        task_id, func, args, kwargs = task
+        start = time.time()
+        try:
+            if shm_threshold is not None:
+                args = tuple(_shm_get(a) if isinstance(a, _ShmRef) else a for a in args)
+                kwargs = dict((k, _shm_get(v) if isinstance(v, _ShmRef) else v)
+                              for k, v in kwargs.items())
+            ok, value = True, func(*args, **kwargs)
+            if shm_threshold is not None and _shm_transportable(value, shm_threshold):
+                value = _shm_put(value)
+        except Exception as e:
+            ok, value = False, _dump_exception(e)
+        run_time = time.time() - start
+        del args, kwargs
+        tasks_done += 1
+        if context is not None:
+            context.tasks_done = tasks_done
+        retiring = (max_tasks is not None and tasks_done >= max_tasks) or \
+                   (max_rss is not None and _worker_memory(rss_baseline) > max_rss)
+        try:
+            data = pickle.dumps((task_id, ok, value, retiring, run_time), pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            data = pickle.dumps((task_id, False, _dump_exception(e), retiring, run_time),
+                                pickle.HIGHEST_PROTOCOL)
+        last_result = value if ok and isinstance(value, _ShmRef) else None
+        try:
+            conn.send_bytes(data)
+        except (IOError, OSError):
+            if last_result is not None:
+                _shm_close(last_result)
+            return
+        if retiring:
+            return
+
+
+class LatencyHistogram(object):
+    """
+    HDR风格的对数-线性直方图：以微秒为单位，每个2的幂区间再等分为16个桶，
+    相对误差约3%，内存占用与样本数无关
+    """
+    SUB_BITS = 5
+    SUB_COUNT = 1 << SUB_BITS
+    HALF_COUNT = SUB_COUNT >> 1
+
+    def __init__(self):
+        self.counts = {}  # 桶序号 -> 样本数
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def _bucket(cls, micros):
+        if micros < cls.SUB_COUNT:
+            return micros
+        shift = micros.bit_length() - cls.SUB_BITS
+        return cls.SUB_COUNT + (shift - 1) * cls.HALF_COUNT + ((micros >> shift) - cls.HALF_COUNT)
+
+    @classmethod
+    def _bucket_value(cls, index):
+        """
+        桶的上界(微秒)
+        """
+        if index < cls.SUB_COUNT:
+            return index
+        shift = (index - cls.SUB_COUNT) // cls.HALF_COUNT + 1
+        top = (index - cls.SUB_COUNT) % cls.HALF_COUNT + cls.HALF_COUNT
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds):
+        """
+        记录一个耗时样本
+        :param seconds: 耗时(秒)
+        :return:
+        """
+        seconds = max(0.0, seconds)
+        index = self._bucket(int(seconds * 1e6))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, pct):
+        """
+        百分位数
+        :param pct: 0-100
+        :return: 耗时(秒)，没有样本时返回None
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * pct / 100.0)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self._bucket_value(index) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        汇总信息
+        :return: dict，单位为秒
+        """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
+
+
+class _PoolStats(object):
+    """
+    任务计数器和耗时直方图：排队等待、执行、IPC(分发到收到结果的时间减去执行时间)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ('submitted', 'completed', 'failed', 'cancelled', 'expired', 'lost'), 0)
+        self.queue_wait = LatencyHistogram()
+        self.run_time = LatencyHistogram()
+        self.ipc_time = LatencyHistogram()
+
+    def record_submit(self):
+        with self._lock:
+            self.counters['submitted'] += 1
+
+    def record_done(self, future):
+        """
+        按结束方式计数，在TaskFuture的完成回调中调用
+        :param future:
+        :return:
+        """
+        if future.cancelled():
+            key = 'cancelled'
+        elif isinstance(future._exception, DeadlineExceededError):
+            key = 'expired'
+        elif isinstance(future._exception, WorkerLostError):
+            key = 'lost'
+        elif future._exception is not None:
+            key = 'failed'
+        else:
+            key = 'completed'
+        with self._lock:
+            self.counters[key] += 1
+
+    def record_timing(self, future, run_time, round_trip=None):
+        """
+        记录一个已执行任务的耗时
+        :param future:
+        :param run_time: worker内执行耗时
+        :param round_trip: 从分发到收到结果的耗时，线程池为None
+        :return:
+        """
+        with self._lock:
+            if future._started_at is not None:
+                self.queue_wait.record(future._started_at - future._submitted_at)
+            self.run_time.record(run_time)
+            if round_trip is not None:
+                self.ipc_time.record(round_trip - run_time)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'queue_wait': self.queue_wait.snapshot(),
+                'run_time': self.run_time.snapshot(),
+                'ipc_time': self.ipc_time.snapshot(),
+            }
+
+
+class _TaskDispatchMixin(object):
+    """
+    基于submit的批量接口，子类需实现submit和_worker_count(当前工作进程/线程数)
+    """
+
+    def _window_size(self):
+        """
+        批量接口同时在途的分块数
+        :return:
+        """
+        return 2 * max(1, self._worker_count())
+
+    def _iter_chunk_futures(self, func, iterable, chunksize, runner=_run_chunk, extra=()):
+        """
+        惰性切分输入并逐块提交，生成每个分块的TaskFuture
+        :param func:
+        :param iterable:
+        :param chunksize: 为None时根据实测耗时自适应分块
+        :param runner: 在worker中处理一个分块的函数，返回(执行耗时, 结果list)
+        :param extra: 传给runner的额外参数
+        :return:
+        """
+        it = iter(iterable)
+        if chunksize is not None:
+            chunksize = max(1, int(chunksize))
+            for chunk in _iter_chunks(it, chunksize):
+                yield self.submit(runner, func, chunk, *extra)
+            return
+        try:
+            total = len(iterable)
+        except TypeError:
+            total = None
+        chunker = _AdaptiveChunker(self._worker_count(), total)
+
+        def on_done(count, future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            chunker.record(count, future.result()[0], future._finished_at - future._started_at)
+
+        while True:
+            chunk = list(itertools.islice(it, chunker.next_size()))
+            if not chunk:
+                return
+            future = self.submit(runner, func, chunk, *extra)
+            future.add_done_callback(functools.partial(on_done, len(chunk)))
+            yield future
+
+    def imap(self, func, iterable, chunksize=None):
+        """
+        按输入顺序返回func(item)结果的迭代器，输入分块、限量提交，不会一次性物化全部任务
+        :param func: 需要执行的函数，须可序列化
+        :param iterable: 输入
+        :param chunksize: 每个任务包含的元素数，None表示自适应
+        :return:
+        """
+        window = collections.deque()
+        try:
+            for future in self._iter_chunk_futures(func, iterable, chunksize):
+                window.append(future)
+                if len(window) >= self._window_size():
+                    for result in window.popleft().result()[1]:
+                        yield result
+            while window:
+                for result in window.popleft().result()[1]:
+                    yield result
+        finally:
+            for future in window:
+                future.cancel()
+
+    def _iter_completed(self, func, iterable, chunksize, runner=_run_chunk, extra=()):
+        """
+        限量提交分块，按完成顺序生成各分块的结果list；生成器关闭时取消未开始的分块
+        :return:
+        """
+        done_queue = queue.Queue()
+        outstanding = set()
+        futures = self._iter_chunk_futures(func, iterable, chunksize, runner, extra)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(outstanding) < self._window_size():
+                    future = next(futures, None)
+                    if future is None:
+                        exhausted = True
+                        break
+                    outstanding.add(future)
+                    future.add_done_callback(done_queue.put)
+                if not outstanding:
+                    return
+                future = done_queue.get()
+                outstanding.discard(future)
+                yield future.result()[1]
+        finally:
+            for future in outstanding:
+                future.cancel()
+
+    def imap_unordered(self, func, iterable, chunksize=None):
+        """
+        按完成顺序返回func(item)结果的迭代器，慢任务不会阻塞已完成结果的返回
+        :param func: 需要执行的函数，须可序列化
+        :param iterable: 输入
+        :param chunksize: 每个任务包含的元素数，None表示自适应
+        :return:
+        """
+        for results in self._iter_completed(func, iterable, chunksize):
+            for result in results:
+                yield result
+
+    def find_first(self, predicate, iterable, chunksize=None, default=None):
+        """
+        并行查找满足predicate的元素，命中后立即取消尚未开始的分块并返回。
+        输入按分块限量提交，父进程中最多只保留_window_size个在途分块；
+        已在执行的分块会跑完当前分块，自适应分块保证其耗时有上限
+        :param predicate: 判断函数，须可序列化
+        :param iterable: 输入
+        :param chunksize: 每个任务包含的元素数，None表示自适应
+        :param default: 没有命中时的返回值
+        :return: 最先被找到的命中元素(不保证是输入顺序中的第一个)
+        """
+        searcher = self._iter_completed(predicate, iterable, chunksize, _find_in_chunk, (False,))
+        try:
+            for hits in searcher:
+                if hits:
+                    return hits[0]
+        finally:
+            searcher.close()
+        return default
+
+    def any_match(self, predicate, iterable, chunksize=None):
+        """
+        是否存在满足predicate的元素，命中即停止
+        :param predicate:
+        :param iterable:
+        :param chunksize:
+        :return:
+        """
+        searcher = self._iter_completed(predicate, iterable, chunksize, _find_in_chunk, (False,))
+        try:
+            for hits in searcher:
+                if hits:
+                    return True
+        finally:
+            searcher.close()
+        return False
+
+    def all_match(self, predicate, iterable, chunksize=None):
+        """
+        是否所有元素都满足predicate，遇到第一个不满足的元素即停止
+        :param predicate:
+        :param iterable:
+        :param chunksize:
+        :return:
+        """
+        searcher = self._iter_completed(predicate, iterable, chunksize, _find_in_chunk, (True,))
+        try:
+            for misses in searcher:
+                if misses:
+                    return False
+        finally:
+            searcher.close()
+        return True
+
+    def map(self, func, iterable, chunksize=None):
+        """
+        对iterable中每个元素执行func，按顺序返回结果list
+        :param func: 需要执行的函数，须可序列化
+        :param iterable: 输入
+        :param chunksize: 每个任务包含的元素数，None表示自适应
+        :return:
+        """
+        return list(self.imap(func, iterable, chunksize))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=exc_type is None, cancel_pending=exc_type is not None)
+        return False
+
+
+class _ProcWorker(object):
+    """
+    父进程中记录的常驻子进程
+    """
+
+    def __init__(self, pid, conn):
+        self.pid = pid
+        self.conn = conn
+        self.task = None  # 正在执行的任务
+        self.started_at = time.time()
+        self.last_active = self.started_at  # 最近一次完成任务的时间
+        self.tasks_done = 0
+        self.busy_time = 0.0  # 累计执行任务(含IPC)的时间
+
+
+class _Task(object):
+    """
+    待分发的任务
+    """
+    __slots__ = ('task_id', 'payload', 'future', 'deadline')
+
+    def __init__(self, task_id, payload, future, deadline=None):
+        self.task_id = task_id
+        self.payload = payload
+        self.future = future
+        self.deadline = deadline
+
+
+def _expire(future, deadline):
+    """
+    任务超过deadline时以DeadlineExceededError结束
+    :param future:
+    :param deadline:
+    :return:
+    """
+    future.set_exception(DeadlineExceededError(
+        u"任务已超过deadline[%.3f]秒" % (time.time() - deadline)))
+
+
+def _open_wake_pipe():
+    """
+    创建非阻塞的self-pipe，用于在信号处理函数或其他线程中唤醒select
+    :return: (读端, 写端)
+    """
+    r, w = os.pipe()
+    for fd in (r, w):
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    return r, w
+
+
+def _drain_pipe(fd):
+    """
+    读空self-pipe
+    :param fd:
+    :return:
+    """
+    try:
+        while os.read(fd, 4096):
+            pass
+    except OSError:
+        pass
+
+
+_sigchld_fds = set()  # 收到SIGCHLD时需要通知的self-pipe写端
+_sigchld_installed = [False]
+
+
+def _on_sigchld(signum, frame):
+    """
+    SIGCHLD处理函数，只向self-pipe写一个字节，子进程回收在监控循环中完成
+    :param signum:
+    :param frame:
+    :return:
+    """
+    for fd in list(_sigchld_fds):
+        try:
+            os.write(fd, b'c')
+        except OSError:
+            pass
+
+
+def _watch_sigchld(fd):
+    """
+    登记SIGCHLD通知的self-pipe写端。只在sub_func模式的check_alive中使用：
+    任务分发模式通过管道断开感知子进程退出，不安装信号处理函数，避免打断主线程中的阻塞调用。
+    信号处理函数只能在主线程安装，在其他线程中调用时退化为定时轮询
+    :param fd:
+    :return:
+    """
+    _sigchld_fds.add(fd)
+    if _sigchld_installed[0]:
+        return
+    try:
+        signal.signal(signal.SIGCHLD, _on_sigchld)
+        signal.siginterrupt(signal.SIGCHLD, False)
+        _sigchld_installed[0] = True
+    except ValueError:
+        pass
+
+
+def _reap_pids(pids):
+    """
+    以WNOHANG方式回收给定pid中所有已退出的子进程，不会阻塞
+    :param pids:
+    :return: [(pid, status)]，status为None表示进程已被其他地方回收
+    """
+    exited = []
+    for pid in list(pids):
+        try:
+            rpid, status = os.waitpid(pid, os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.ECHILD:
+                exited.append((pid, None))
+            continue
+        if rpid:
+            exited.append((rpid, status))
+    return exited
+
+
+def _reset_child_signals():
+    """
+    fork出的子进程恢复默认信号处理，避免继承父进程的kill/SIGCHLD处理函数
+    :return:
+    """
+    for sig in (signal.SIGTERM, signal.SIGQUIT, signal.SIGHUP, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+
+
+class _RestartBackoff(object):
+    """
+    子进程重启的指数退避：子进程启动后很快异常退出(被信号杀死或退出码非0)视为崩溃，
+    连续崩溃时重启间隔按base * 2^n增长，直到maximum；稳定运行或正常退出后清零
+    """
+
+    def __init__(self, base=0.1, maximum=30.0, stable_after=10.0):
+        """
+        :param base: 首次崩溃后的重启间隔(秒)
+        :param maximum: 重启间隔上限(秒)
+        :param stable_after: 子进程存活超过该时长(秒)后退出不计为崩溃
+        """
+        self.base = base
+        self.maximum = maximum
+        self.stable_after = stable_after
+        self.failures = 0  # 连续崩溃次数
+        self.restart_count = 0
+        self.crash_count = 0
+        self._next_allowed = 0.0
+
+    def record_exit(self, lifetime, productive=False, status=None):
+        """
+        记录一次子进程退出
+        :param lifetime: 子进程存活时长(秒)
+        :param productive: 子进程退出前是否成功完成过任务，完成过任务的不是崩溃循环，不参与退避
+        :param status: waitpid返回的退出状态，退出码为0的正常退出不是崩溃；None表示未知
+        :return:
+        """
+        clean = status is not None and os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+        if lifetime < self.stable_after and not productive and not clean:
+            self.failures += 1
+            self.crash_count += 1
+            delay = min(self.maximum, self.base * (2 ** (self.failures - 1)))
+            self._next_allowed = max(self._next_allowed, time.time() + delay)
+        else:
+            if productive and not clean and lifetime < self.stable_after:
+                self.crash_count += 1
+            self.failures = 0
+
+    def remaining(self):
+        """
+        距离允许下一次重启的时间(秒)
+        :return:
+        """
+        return max(0.0, self._next_allowed - time.time())
+
+    def record_restart(self):
+        self.restart_count += 1
+
+
 # 1.根据不同的操作系统自己创建、管理进程池
 class WorkProcPoolWindows(object):
     """
@@ -22,16 +1219,20 @@ class WorkProcPoolWindows(object):
     """
     proc_list = []
 
-    def __init__(self, proc_num, func, args=None):
+    def __init__(self, proc_num, func, args=None, initializer=None, initargs=()):
         """
         初始化Windows进程池
         :param proc_num: 进程数量
         :param func: 需要执行的函数
         :param args: 传入func的参数
+        :param initializer: 每个子进程启动时先执行initializer(*initargs)，须可序列化
+        :param initargs: 传入initializer的参数
         """
         self.func = func
         self.args = args
         self.proc_num = proc_num
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
         self.create_pool()
 
     def create_pool(self):
@@ -47,60 +1248,315 @@ class WorkProcPoolWindows(object):
         创建响应进程
         :return:
         """
-        if self.args is None:
-            p = multiprocessing.Process(target=self.func)
-        else:
-            p = multiprocessing.Process(target=self.func, args=(self.args,))
-        p.daemon = True
-        p.start()
-        return p
+        if self.initializer is not None:
+            p = multiprocessing.Process(target=_bootstrap_process,
+                                        args=(self.initializer, self.initargs, self.func,
+                                              self.args))
+        elif self.args is None:
+            p = multiprocessing.Process(target=self.func)
+        else:
+            p = multiprocessing.Process(target=self.func, args=(self.args,))
+        p.daemon = True
+        p.start()
+        return p
+
+    def check_alive(self):
+        """
+        检查进程池内的进程是否存在，若不存在则重新创建
+        :return:
+        """
+        self.proc_list = [p if p.is_alive() else self.create_process() for p in self.proc_list]
+
+    def reg_signal(self):
+        """
+        注册signal
+        :return:
+        """
+        # signal.signal(signal.SIGINT, self.kill)
+        signal.signal(signal.SIGTERM, self.kill)
+
+    def kill(self, signum, frame):
+        """
+        杀死进程
+        :param signum:
+        :param frame:
+        :return:
+        """
+        logging.info(u"got signal:%d" % signum)
+        for pid in self.proc_list:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit()
+
+
+class _ThreadTask(object):
+    """
+    线程池中待执行的任务
+    """
+    __slots__ = ('func', 'args', 'kwargs', 'future', 'deadline')
+
+    def __init__(self, func, args, kwargs, future, deadline=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.deadline = deadline
+
+
+class WorkThreadPoolWindows(_TaskDispatchMixin):
+    """
+    Windows线程池类
+
+    传入func时，每个线程执行一次func(args)；func为None时进入任务分发模式：
+    每个工作线程有自己的任务队列(deque)，自己的队列为空时从其他线程的队列尾部窃取任务，
+    任务耗时不均时空闲线程不会干等，适合HTTP请求、MySQL查询等I/O密集型任务
+    """
+    thread_list = []
+
+    def __init__(self, thread_num, func=None, args=None, max_inflight=None, initializer=None,
+                 initargs=()):
+        """
+        初始化线程池
+        :type thread_num: int
+        :param thread_num: 线程数
+        :param func: 需要执行的函数，为None时进入任务分发模式
+        :param args: 传入func的参数
+        :param max_inflight: 任务分发模式下最多允许的在途(排队+执行中)任务数，None表示不限制
+        :param initializer: 任务分发模式下每个工作线程启动时执行一次initializer(*initargs)，
+            其创建的资源可通过get_worker_context()在本线程后续任务中复用
+        :param initargs: 传入initializer的参数
+        """
+        self.func = func
+        self.args = args
+        self.thread_num = thread_num
+        self.max_inflight = max_inflight
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        if func is None:
+            self._start_task_mode()
+        else:
+            self.create_pool()
+
+    def _start_task_mode(self):
+        """
+        任务分发模式：为每个工作线程创建任务队列并启动线程
+        :return:
+        """
+        self.thread_list = []
+        self._queues = [collections.deque() for _ in range(self.thread_num)]
+        # 指定了非默认优先级的任务放入共享堆：priority<0的任务先于各线程队列执行，
+        # priority>0的任务在所有队列都空闲时执行
+        self._prioritized = []
+        self._task_ids = itertools.count()
+        self._cond = threading.Condition()
+        self._local = threading.local()  # 记录当前线程在本线程池中的序号
+        self._next_queue = itertools.count()
+        self._inflight = 0
+        self._closed = False
+        self._stats = _PoolStats()
+        for index in range(self.thread_num):
+            self.thread_list.append(self._start_worker(index))
+
+    def _start_worker(self, index):
+        """
+        启动第index个工作线程
+        :param index:
+        :return:
+        """
+        t = threading.Thread(target=self._worker_loop, args=(index,),
+                             name='WorkThreadPoolWorker-%d' % index)
+        t.daemon = True
+        t.start()
+        return t
+
+    def _worker_count(self):
+        return len(self.thread_list)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        提交一个任务到工作线程执行，在途任务数达到max_inflight时阻塞直到有任务结束
+        :param func: 需要执行的函数
+        :param args: 传入func的位置参数
+        :param kwargs: 传入func的关键字参数
+        :return: TaskFuture
+        """
+        return self.submit_task(func, args, kwargs)
+
+    def submit_nowait(self, func, *args, **kwargs):
+        """
+        同submit，但在途任务数达到max_inflight时不阻塞，抛出PoolBusyError
+        :param func: 需要执行的函数
+        :param args: 传入func的位置参数
+        :param kwargs: 传入func的关键字参数
+        :return: TaskFuture
+        """
+        return self.submit_task(func, args, kwargs, block=False)
+
+    def submit_task(self, func, args=(), kwargs=None, priority=0, deadline=None, block=True):
+        """
+        提交任务，可指定优先级和截止时间
+        :param func: 需要执行的函数
+        :param args: 传入func的位置参数
+        :param kwargs: 传入func的关键字参数
+        :param priority: 优先级，数值越小越先执行；为0的任务走各线程队列和工作窃取
+        :param deadline: 截止时间(time.time()时间戳)，开始执行前已超过时任务不再执行，
+            以DeadlineExceededError结束
+        :param block: 在途任务数达到max_inflight时是否阻塞，False时抛出PoolBusyError
+        :return: TaskFuture
+        """
+        return self._submit(func, tuple(args), kwargs or {}, block, priority, deadline)
+
+    def _submit(self, func, args, kwargs, block, priority=0, deadline=None):
+        """
+        将任务放入工作线程的队列：在工作线程内提交时放入本线程队列，否则轮流放入各线程队列；
+        非默认优先级的任务放入共享堆
+        :param func:
+        :param args:
+        :param kwargs:
+        :param block: 在途任务已满时是否阻塞等待
+        :param priority:
+        :param deadline:
+        :return: TaskFuture
+        """
+        if self.func is not None:
+            raise RuntimeError(u"线程池未处于任务分发模式")
+        future = TaskFuture()
+        task = _ThreadTask(func, args, kwargs, future, deadline)
+        index = getattr(self._local, 'index', None)
+        if index is None:
+            index = next(self._next_queue) % len(self._queues)
+        with self._cond:
+            while self.max_inflight is not None and self._inflight >= self.max_inflight:
+                if self._closed:
+                    break
+                if not block:
+                    raise PoolBusyError(u"在途任务数已达上限[%d]" % self.max_inflight)
+                self._cond.wait()
+            if self._closed:
+                raise PoolClosedError(u"线程池已关闭")
+            self._inflight += 1
+            self._stats.record_submit()
+            if priority:
+                heapq.heappush(self._prioritized, (priority, next(self._task_ids), task))
+            else:
+                self._queues[index].append(task)
+            self._cond.notify()
+        future.add_done_callback(self._release_slot)
+        return future
+
+    def _release_slot(self, future):
+        self._stats.record_done(future)
+        with self._cond:
+            self._inflight -= 1
+            if self.max_inflight is not None:
+                self._cond.notify_all()
+
+    def stats(self):
+        """
+        线程池运行状态快照：任务计数、排队/执行耗时直方图、队列深度
+        :return: dict，耗时单位为秒
+        """
+        snapshot = self._stats.snapshot()
+        snapshot.update({
+            'workers': len(self.thread_list),
+            'queue_depth': sum(len(tasks) for tasks in self._queues) + len(self._prioritized),
+            'inflight': self._inflight,
+        })
+        return snapshot
 
-    def check_alive(self):
+    def _take(self, index):
         """
-        检查进程池内的进程是否存在，若不存在则重新创建
-        :return:
+        取下一个任务：高优先级任务 > 本线程队列头部 > 从其他线程队列尾部窃取 > 低优先级任务
+        :param index:
+        :return: _ThreadTask，没有任务时返回None
         """
-        self.proc_list = [p if p.is_alive() else self.create_process() for p in self.proc_list]
+        if self._prioritized and self._prioritized[0][0] < 0:
+            task = self._pop_prioritized(True)
+            if task is not None:
+                return task
+        queues = self._queues
+        try:
+            return queues[index].popleft()
+        except IndexError:
+            pass
+        count = len(queues)
+        for offset in range(1, count):
+            try:
+                return queues[(index + offset) % count].pop()
+            except IndexError:
+                continue
+        if self._prioritized:
+            return self._pop_prioritized(False)
+        return None
 
-    def reg_signal(self):
+    def _pop_prioritized(self, urgent_only):
         """
-        注册signal
+        从共享堆中取优先级最高的任务
+        :param urgent_only: 是否只取priority<0的任务
         :return:
         """
-        # signal.signal(signal.SIGINT, self.kill)
-        signal.signal(signal.SIGTERM, self.kill)
+        with self._cond:
+            if self._prioritized and (not urgent_only or self._prioritized[0][0] < 0):
+                return heapq.heappop(self._prioritized)[2]
+        return None
 
-    def kill(self, signum, frame):
+    def _worker_loop(self, index):
         """
-        杀死进程
-        :param signum:
-        :param frame:
+        工作线程：执行本线程队列中的任务，队列为空时窃取其他线程的任务，都没有任务时等待
+        :param index:
         :return:
         """
-        logging.info(u"got signal:%d" % signum)
-        for pid in self.proc_list:
-            os.kill(pid, signal.SIGTERM)
-        sys.exit()
-
-
-class WorkThreadPoolWindows(object):
-    """
-    Windows线程池类
-    """
-    thread_list = []
+        self._local.index = index
+        try:
+            _init_worker(self.initializer, self.initargs, index, thread=True)
+        except Exception as e:
+            logging.error(u"线程初始化失败[%s]" % e)
+        context = get_worker_context()
+        while True:
+            task = self._take(index)
+            if task is None:
+                with self._cond:
+                    while not self._prioritized and not any(self._queues):
+                        if self._closed:
+                            return
+                        self._cond.wait()
+                continue
+            if task.deadline is not None and task.deadline <= time.time():
+                _expire(task.future, task.deadline)
+            if not task.future.set_running():
+                continue
+            start = time.time()
+            try:
+                result = task.func(*task.args, **task.kwargs)
+            except Exception as e:
+                self._stats.record_timing(task.future, time.time() - start)
+                task.future.set_exception(e)
+            else:
+                self._stats.record_timing(task.future, time.time() - start)
+                task.future.set_result(result)
+            context.tasks_done += 1
 
-    def __init__(self, thread_num, func, args=None):
+    def shutdown(self, wait=True, cancel_pending=False):
         """
-        初始化线程池
-        :type thread_num: int
-        :param thread_num: 线程数
-        :param func: 需要执行的函数
-        :param args: 传入func的参数
+        关闭线程池，已提交的任务执行完后工作线程退出
+        :param wait: 是否阻塞等待
+        :param cancel_pending: 是否取消尚未开始的任务
+        :return:
         """
-        self.func = func
-        self.args = args
-        self.thread_num = thread_num
-        self.create_pool()
+        with self._cond:
+            self._closed = True
+            if cancel_pending:
+                while self._prioritized:
+                    heapq.heappop(self._prioritized)[2].future.cancel()
+                for tasks in self._queues:
+                    while tasks:
+                        try:
+                            tasks.popleft().future.cancel()
+                        except IndexError:
+                            break
+            self._cond.notify_all()
+        if wait:
+            for t in self.thread_list:
+                t.join()
 
     def create_pool(self):
         """
@@ -127,10 +1583,20 @@ class WorkThreadPoolWindows(object):
 
     def check_alive(self):
         """
-        检查进程池内的进程是否存在，若不存在则重新创建
+        检查线程池内的线程是否存在，若不存在则重新创建并启动
         :return:
         """
-        self.thread_list = [t if t.isAlive() else self.create_thread() for t in self.thread_list]
+        if self.func is None:
+            self.thread_list = [t if t.is_alive() else self._start_worker(index)
+                                for index, t in enumerate(self.thread_list)]
+            return
+        thread_list = []
+        for t in self.thread_list:
+            if not t.is_alive():
+                t = self.create_thread()
+                t.start()
+            thread_list.append(t)
+        self.thread_list = thread_list
 
     def reg_signal(self):
         """
@@ -147,25 +1613,601 @@ class WorkThreadPoolWindows(object):
         pass
 
 
-class WorkProcPoolLinux(object):
+class WorkProcPoolLinux(_TaskDispatchMixin):
     """
     Linux进程池类
+
+    传入sub_func时，每个子进程执行一次sub_func(args)后退出；
+    sub_func为None时进入任务分发模式：预先fork常驻子进程，通过submit/map分发任务，
+    子进程在任务之间保持存活，避免每个任务重复fork和导入模块
     """
     process_list = []
 
-    def __init__(self, proc_num, sub_func, args=None):
+    SCALE_INTERVAL = 0.5  # 两次扩容之间的最小间隔(秒)
+    SCALE_DRAIN_TIME = 1.0  # 扩容目标：积压任务在该时间(秒)内被消化
+
+    def __init__(self, proc_num, sub_func=None, args=None, max_inflight=None, transport='pipe',
+                 shm_threshold=1 << 20, initializer=None, initargs=(), min_workers=None,
+                 max_workers=None, idle_timeout=60.0, max_tasks_per_child=None,
+                 max_rss_bytes=None, stats_interval=None):
         """
         初始化Linux进程池
         :type proc_num: int
         :param proc_num: 进程数量
-        :param sub_func: 需要执行的函数
+        :param sub_func: 需要执行的函数，为None时进入任务分发模式
         :param args: 传入func的参数
+        :param max_inflight: 任务分发模式下最多允许的在途(排队+执行中)任务数，None表示不限制
+        :param transport: 任务分发模式下参数/结果的传输方式，'pipe': 序列化后经管道传输；
+            'shm': 不小于shm_threshold字节的numpy数组和bytes通过共享内存传输，管道中只传句柄。
+            共享内存中的参数在worker里是只读的，任务在途期间调用方不应修改该参数
+        :param shm_threshold: 使用共享内存传输的最小字节数
+        :param initializer: 每个子进程启动时执行一次initializer(*initargs)，之后的任务可通过
+            get_worker_context()复用其创建的资源；子进程被重新拉起时重新执行
+        :param initargs: 传入initializer的参数
+        :param min_workers: 任务分发模式下自动伸缩的最小子进程数，默认为proc_num
+        :param max_workers: 任务分发模式下自动伸缩的最大子进程数，默认为proc_num；
+            大于min_workers时，根据积压任务数、任务耗时和系统负载自动增减子进程
+        :param idle_timeout: 子进程空闲超过该时间(秒)且数量多于min_workers时被回收
+        :param max_tasks_per_child: 任务分发模式下每个子进程执行多少个任务后被替换，None表示不限制
+        :param max_rss_bytes: 任务分发模式下子进程独占内存上限(字节，不含fork时与父进程共享的页)，
+            在两个任务之间检查，超过后子进程在当前任务完成后退出并被替换，不会中断执行中的任务
+        :param stats_interval: 任务分发模式下每隔多少秒把stats()输出到日志，None表示不输出
         """
+        if transport not in ('pipe', 'shm'):
+            raise ValueError(u"不支持的transport[%s]" % transport)
         self.sub_func = sub_func
         self.args = args
-        self.proc_num = proc_num
-        # 创建进程池
-        self.create_pool()
+        self.min_workers = proc_num if min_workers is None else min_workers
+        self.max_workers = max(proc_num if max_workers is None else max_workers, self.min_workers)
+        self.proc_num = min(max(proc_num, self.min_workers), self.max_workers)
+        self.idle_timeout = idle_timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self.max_rss_bytes = max_rss_bytes
+        self.recycle_count = 0  # 因回收策略被替换的子进程数
+        self.stats_interval = stats_interval
+        self._stats = _PoolStats()
+        self._next_stats_dump = time.time() + stats_interval if stats_interval else None
+        self.max_inflight = max_inflight
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self._worker_ids = itertools.count()
+        self._shm = _ShmArgCache(max(1, shm_threshold)) if transport == 'shm' else None
+        if self._shm is not None:
+            _cleanup_stale_shm()
+        self._backoff = _RestartBackoff()
+        self._started_at = {}  # pid -> 启动时间
+        self._retired = set()  # 主动回收的子进程，退出不计为崩溃
+        self._latency = None  # 任务执行耗时的滑动平均
+        self._last_scale = 0.0
+        # self-pipe，SIGCHLD或新任务到达时唤醒阻塞在select中的监控循环
+        self._wake_r, self._wake_w = _open_wake_pipe()
+        # 每个池只管理自己的子进程，不能共用类属性
+        self.process_list = []
+        self._lock = threading.Condition()
+        self._closed = False
+        if sub_func is None:
+            self._start_task_mode()
+        else:
+            # 创建进程池
+            self.create_pool()
+
+    @property
+    def restart_count(self):
+        """
+        子进程被重新拉起的次数
+        :return:
+        """
+        return self._backoff.restart_count
+
+    @property
+    def crash_count(self):
+        """
+        子进程启动后很快退出(视为崩溃)的次数
+        :return:
+        """
+        return self._backoff.crash_count
+
+    def _start_task_mode(self):
+        """
+        任务分发模式：fork常驻子进程并启动管理线程
+        :return:
+        """
+        self.process_list = []
+        self._workers = {}  # pid -> _ProcWorker
+        self._pending = []  # 按(priority, task_id)排序的堆
+        self._deadlines = []  # 按(deadline, task_id)排序的堆，用于尽早淘汰超时任务
+        self._task_ids = itertools.count()
+        self._inflight = 0  # 已提交且尚未结束的任务数
+        self._zombies = {}  # 已断开但尚未回收的子进程 pid -> _ProcWorker
+        for _ in range(self.proc_num):
+            self._spawn_worker()
+        self._manager = threading.Thread(target=self._manage_loop, name='WorkProcPoolManager')
+        self._manager.daemon = True
+        self._manager.start()
+
+    def _spawn_worker(self):
+        """
+        fork一个常驻子进程
+        :return:
+        """
+        parent_conn, child_conn = multiprocessing.Pipe()
+        worker_id = next(self._worker_ids)
+        pid = os.fork()
+        if pid == 0:  # 子进程
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                _reset_child_signals()
+                parent_conn.close()
+                for worker in self._workers.values():
+                    worker.conn.close()
+                os.close(self._wake_r)
+                os.close(self._wake_w)
+                _init_worker(self.initializer, self.initargs, worker_id)
+                _proc_worker_loop(child_conn, self._shm.threshold if self._shm else None,
+                                  self.max_tasks_per_child, self.max_rss_bytes)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        child_conn.close()
+        self._workers[pid] = _ProcWorker(pid, parent_conn)
+        self._started_at[pid] = time.time()
+        self.process_list.append(pid)
+
+    def _wakeup(self):
+        """
+        唤醒管理线程
+        :return:
+        """
+        try:
+            os.write(self._wake_w, b'x')
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EBADF):
+                raise
+
+    def _worker_count(self):
+        return len(self._workers)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        提交一个任务到常驻子进程执行，在途任务数达到max_inflight时阻塞直到有任务结束
+        :param func: 需要执行的函数，须可序列化(模块级函数)
+        :param args: 传入func的位置参数
+        :param kwargs: 传入func的关键字参数
+        :return: TaskFuture
+        """
+        return self.submit_task(func, args, kwargs)
+
+    def submit_nowait(self, func, *args, **kwargs):
+        """
+        同submit，但在途任务数达到max_inflight时不阻塞，抛出PoolBusyError
+        :param func: 需要执行的函数，须可序列化(模块级函数)
+        :param args: 传入func的位置参数
+        :param kwargs: 传入func的关键字参数
+        :return: TaskFuture
+        """
+        return self.submit_task(func, args, kwargs, block=False)
+
+    def submit_task(self, func, args=(), kwargs=None, priority=0, deadline=None, block=True):
+        """
+        提交任务，可指定优先级和截止时间
+        :param func: 需要执行的函数，须可序列化(模块级函数)
+        :param args: 传入func的位置参数
+        :param kwargs: 传入func的关键字参数
+        :param priority: 优先级，数值越小越先执行，相同优先级按提交顺序执行
+        :param deadline: 截止时间(time.time()时间戳)，开始执行前已超过时任务不再执行，
+            以DeadlineExceededError结束
+        :param block: 在途任务数达到max_inflight时是否阻塞，False时抛出PoolBusyError
+        :return: TaskFuture
+        """
+        return self._submit(func, tuple(args), kwargs or {}, block, priority, deadline)
+
+    def _submit(self, func, args, kwargs, block, priority=0, deadline=None):
+        """
+        序列化任务并加入待执行队列
+        :param func:
+        :param args:
+        :param kwargs:
+        :param block: 在途任务已满时是否阻塞等待
+        :param priority:
+        :param deadline:
+        :return: TaskFuture
+        """
+        if self.sub_func is not None:
+            raise RuntimeError(u"进程池未处于任务分发模式")
+        task_id = next(self._task_ids)
+        shared = []
+        if self._shm is not None:
+            args, kwargs = self._shm.encode(args, kwargs, shared)
+        future = TaskFuture()
+        try:
+            payload = pickle.dumps((task_id, func, args, kwargs), pickle.HIGHEST_PROTOCOL)
+            with self._lock:
+                while self.max_inflight is not None and self._inflight >= self.max_inflight:
+                    if self._closed:
+                        break
+                    if not block:
+                        raise PoolBusyError(u"在途任务数已达上限[%d]" % self.max_inflight)
+                    self._lock.wait()
+                if self._closed:
+                    raise PoolClosedError(u"进程池已关闭")
+                self._inflight += 1
+                self._stats.record_submit()
+                task = _Task(task_id, payload, future, deadline)
+                heapq.heappush(self._pending, (priority, task_id, task))
+                if deadline is not None:
+                    heapq.heappush(self._deadlines, (deadline, task_id, task))
+                # 有空闲子进程可以立即分发，或新任务的deadline最早，需要缩短管理线程的等待
+                wake = any(w.task is None for w in self._workers.values()) or \
+                    (deadline is not None and self._deadlines[0][1] == task_id)
+        except Exception:
+            if shared:
+                self._shm.release(shared)
+            raise
+        future.add_done_callback(self._release_slot)
+        if shared:
+            future.add_done_callback(functools.partial(self._shm.release, shared))
+        if wake:
+            self._wakeup()
+        return future
+
+    def _release_slot(self, future):
+        """
+        任务结束(含取消)后释放在途名额，唤醒阻塞在submit中的调用方
+        :param future:
+        :return:
+        """
+        self._stats.record_done(future)
+        with self._lock:
+            self._inflight -= 1
+            self._lock.notify_all()
+
+    def stats(self):
+        """
+        进程池运行状态快照：任务计数、排队/执行/IPC耗时直方图、队列深度、
+        每个子进程的任务数和忙碌比例、重启次数；sub_func模式下只有子进程数和重启次数
+        :return: dict，耗时单位为秒
+        """
+        if self.sub_func is not None:
+            return {
+                'workers': len(self.process_list),
+                'target_workers': self.proc_num,
+                'restart_count': self.restart_count,
+                'crash_count': self.crash_count,
+            }
+        snapshot = self._stats.snapshot()
+        now = time.time()
+        with self._lock:
+            snapshot.update({
+                'workers': len(self._workers),
+                'target_workers': self.proc_num,
+                'queue_depth': sum(1 for _, _, task in self._pending if not task.future.done()),
+                'inflight': self._inflight,
+                'restart_count': self.restart_count,
+                'crash_count': self.crash_count,
+                'recycle_count': self.recycle_count,
+                'worker_stats': dict(
+                    (w.pid, {'tasks': w.tasks_done,
+                             'busy_ratio': w.busy_time / max(now - w.started_at, 1e-6)})
+                    for w in self._workers.values()),
+            })
+        return snapshot
+
+    def _dump_stats(self):
+        """
+        定期把stats()输出到日志
+        :return:
+        """
+        now = time.time()
+        if self._next_stats_dump is None or now < self._next_stats_dump:
+            return
+        self._next_stats_dump = now + self.stats_interval
+        try:
+            logging.info(u"进程池统计[%s]" % json.dumps(self.stats(), sort_keys=True))
+        except Exception as e:
+            logging.error(u"输出进程池统计失败[%s]" % e)
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """
+        关闭进程池，等待已提交任务执行完后子进程退出；
+        sub_func模式下不再补齐子进程，wait时等待正在执行sub_func的子进程退出
+        :param wait: 是否阻塞等待
+        :param cancel_pending: 是否取消尚未开始的任务
+        :return:
+        """
+        if self.sub_func is not None:
+            self._closed = True
+            if wait:
+                self._wait_children()
+            return
+        with self._lock:
+            self._closed = True
+            if cancel_pending:
+                while self._pending:
+                    heapq.heappop(self._pending)[2].future.cancel()
+            self._lock.notify_all()
+        self._wakeup()
+        if wait:
+            self._manager.join()
+
+    def terminate(self):
+        """
+        立即杀死所有子进程，未完成的任务以WorkerLostError/取消结束
+        :return:
+        """
+        if self.sub_func is not None:
+            self._closed = True
+            for pid in self.process_list:
+                self._retired.add(pid)  # 主动杀死，不计为崩溃
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+            self._wait_children()
+            return
+        with self._lock:
+            self._closed = True
+            while self._pending:
+                heapq.heappop(self._pending)[2].future.cancel()
+            for pid in list(self._workers):
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+        self._wakeup()
+        self._manager.join()
+
+    def _manage_loop(self):
+        """
+        管理线程：分发任务、收集结果、补齐异常退出的子进程
+        :return:
+        """
+        while True:
+            with self._lock:
+                self._supervise()
+                self._expire_tasks()
+                self._dispatch()
+                if not self._closed and self._autoscale():
+                    self._dispatch()
+                if self._closed and not self._pending and \
+                        all(w.task is None for w in self._workers.values()):
+                    break
+                conns = dict((w.conn.fileno(), w) for w in self._workers.values())
+                timeout = 1.0
+                if not self._closed and len(self._workers) < self.proc_num:
+                    timeout = min(timeout, self._backoff.remaining())
+                if self._deadlines:
+                    timeout = max(0.0, min(timeout, self._deadlines[0][0] - time.time()))
+                if self._next_stats_dump is not None:
+                    timeout = max(0.0, min(timeout, self._next_stats_dump - time.time()))
+            self._dump_stats()
+            try:
+                readable = select.select(list(conns) + [self._wake_r], [], [], timeout)[0]
+            except (select.error, OSError) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in readable:
+                if fd == self._wake_r:
+                    _drain_pipe(self._wake_r)
+                    continue
+                self._handle_message(conns[fd])
+        self._stop_workers()
+
+    def _supervise(self):
+        """
+        一次性回收所有已退出的子进程，只补齐缺少的子进程，连续崩溃时按指数退避延迟补齐。
+        调用时需持有self._lock
+        :return:
+        """
+        if self._zombies:
+            for pid, status in _reap_pids(self._zombies):
+                worker = self._zombies.pop(pid, None)
+                self._record_exit(pid, status, worker is not None and worker.tasks_done > 0)
+        if self._closed:
+            return
+        while len(self._workers) < self.proc_num and self._backoff.remaining() <= 0:
+            self._spawn_worker()
+            self._backoff.record_restart()
+
+    def _autoscale(self):
+        """
+        在[min_workers, max_workers]之间伸缩：积压任务预计无法在SCALE_DRAIN_TIME内消化且
+        系统负载未饱和时扩容，空闲超过idle_timeout的子进程被回收。调用时需持有self._lock
+        :return: 是否新增了子进程
+        """
+        if self.min_workers == self.max_workers:
+            return False
+        now = time.time()
+        backlog = len(self._pending)
+        idle = [w for w in self._workers.values() if w.task is None]
+        if backlog and not idle and self.proc_num < self.max_workers and \
+                len(self._workers) >= self.proc_num and \
+                now - self._last_scale >= self.SCALE_INTERVAL and not self._load_saturated():
+            extra = 1
+            if self._latency is not None:
+                extra = int(math.ceil(backlog * self._latency / self.SCALE_DRAIN_TIME))
+            extra = max(1, min(extra, backlog, self.max_workers - self.proc_num))
+            logging.info(u"积压任务[%d]，扩容[%d]个子进程" % (backlog, extra))
+            for _ in range(extra):
+                self._spawn_worker()
+            self.proc_num += extra
+            self._last_scale = now
+            return True
+        for worker in idle:
+            if self.proc_num <= self.min_workers:
+                break
+            if now - worker.last_active > self.idle_timeout:
+                self._retire_worker(worker)
+                self.proc_num -= 1
+        return False
+
+    @staticmethod
+    def _load_saturated():
+        """
+        1分钟平均负载是否已达到CPU核数
+        :return:
+        """
+        try:
+            return os.getloadavg()[0] >= multiprocessing.cpu_count()
+        except (OSError, AttributeError, NotImplementedError):
+            return False
+
+    def _retire_worker(self, worker):
+        """
+        通知空闲子进程退出，其退出不计为崩溃。调用时需持有self._lock
+        :param worker:
+        :return:
+        """
+        try:
+            worker.conn.send_bytes(pickle.dumps(None, pickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError):
+            pass
+        self._retired.add(worker.pid)
+        self._handle_worker_exit(worker)
+
+    def _record_exit(self, pid, status, productive=False):
+        """
+        记录子进程退出，用于日志和崩溃退避
+        :param pid:
+        :param status:
+        :param productive: 子进程是否完成过任务
+        :return:
+        """
+        logging.info(u"进程退出[%s]" % str((pid, status)))
+        started_at = self._started_at.pop(pid, None)
+        if pid in self._retired:
+            self._retired.discard(pid)
+        elif started_at is not None:
+            self._backoff.record_exit(time.time() - started_at, productive, status)
+
+    def _expire_tasks(self):
+        """
+        让已超过deadline且尚未开始的任务立即失败，不必等到轮到它们。调用时需持有self._lock
+        :return:
+        """
+        now = time.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, _, task = heapq.heappop(self._deadlines)
+            if not task.future.done() and not task.future.running():
+                _expire(task.future, deadline)
+
+    def _dispatch(self):
+        """
+        按优先级将待执行任务分给空闲子进程，跳过已取消或已超时的任务。调用时需持有self._lock
+        :return:
+        """
+        for worker in list(self._workers.values()):
+            if not self._pending:
+                return
+            if worker.task is not None:
+                continue
+            task = None
+            now = time.time()
+            while self._pending:
+                task = heapq.heappop(self._pending)[2]
+                if task.deadline is not None and task.deadline <= now and \
+                        not task.future.done():
+                    _expire(task.future, task.deadline)
+                if task.future.set_running():
+                    break
+                task = None
+            if task is None:
+                return
+            worker.task = task
+            try:
+                worker.conn.send_bytes(task.payload)
+            except (IOError, OSError):
+                self._handle_worker_exit(worker)
+
+    def _handle_message(self, worker):
+        """
+        读取子进程返回的结果
+        :param worker:
+        :return:
+        """
+        try:
+            task_id, ok, value, retiring, run_time = pickle.loads(worker.conn.recv_bytes())
+        except (EOFError, IOError, OSError):
+            with self._lock:
+                self._handle_worker_exit(worker)
+            return
+        with self._lock:
+            task, worker.task = worker.task, None
+            worker.last_active = time.time()
+            worker.tasks_done += 1
+            if task is not None and task.future._started_at is not None:
+                elapsed = worker.last_active - task.future._started_at
+                worker.busy_time += elapsed
+                self._latency = elapsed if self._latency is None else \
+                    self._latency + 0.2 * (elapsed - self._latency)
+                self._stats.record_timing(task.future, run_time, elapsed)
+            if retiring:
+                # 子进程达到回收条件并已退出，由_supervise补齐
+                self.recycle_count += 1
+                self._retired.add(worker.pid)
+                self._handle_worker_exit(worker)
+            self._lock.notify_all()
+        if task is None or task.task_id != task_id:
+            logging.error(u"收到未知任务的结果[%s]" % task_id)
+            if ok and isinstance(value, _ShmRef):
+                _shm_close(value)
+            return
+        if ok:
+            if isinstance(value, _ShmRef):
+                try:
+                    value = _shm_get(value, unlink=True)
+                except (IOError, OSError) as e:
+                    task.future.set_exception(e)
+                    return
+            task.future.set_result(value)
+        else:
+            task.future.set_exception(pickle.loads(value))
+
+    def _handle_worker_exit(self, worker):
+        """
+        子进程管道断开：在途任务以WorkerLostError结束，进程留待_supervise非阻塞回收并补齐。
+        调用时需持有self._lock
+        :param worker:
+        :return:
+        """
+        worker.conn.close()
+        self._workers.pop(worker.pid, None)
+        self._zombies[worker.pid] = worker
+        if worker.pid in self.process_list:
+            self.process_list.remove(worker.pid)
+        if worker.task is not None:
+            worker.task.future.set_exception(
+                WorkerLostError(u"子进程[%d]异常退出" % worker.pid))
+            worker.task = None
+
+    def _stop_workers(self):
+        """
+        通知所有子进程退出并回收
+        :return:
+        """
+        with self._lock:
+            workers = list(self._workers.values())
+            self._workers.clear()
+            self.process_list = []
+        stop = pickle.dumps(None, pickle.HIGHEST_PROTOCOL)
+        for worker in workers:
+            try:
+                worker.conn.send_bytes(stop)
+            except (IOError, OSError):
+                pass
+        for worker in workers + list(self._zombies.values()):
+            try:
+                os.waitpid(worker.pid, 0)
+            except OSError:
+                pass
+            worker.conn.close()
+        self._zombies.clear()
+        self._started_at.clear()
+        _sigchld_fds.discard(self._wake_w)
+        for fd in (self._wake_r, self._wake_w):
+            os.close(fd)
 
     def create_pool(self):
         """
@@ -175,47 +2217,103 @@ class WorkProcPoolLinux(object):
         index = 0
         while index < self.proc_num:
             index += 1
-            pid = os.fork()
-            if pid == 0:  # 子进程
-                if self.args is not None:
-                    self.sub_func(self.args)
-                else:
+            self.create_process()
+
+    def create_process(self):
+        """
+        fork一个执行sub_func的子进程
+        :return: pid
+        """
+        worker_id = next(self._worker_ids)
+        pid = os.fork()
+        if pid == 0:  # 子进程
+            try:
+                _reset_child_signals()
+                _init_worker(self.initializer, self.initargs, worker_id)
+                if self.args is None:
                     self.sub_func()
+                else:
+                    self.sub_func(self.args)
                 sys.exit()
-            else:  # 父进程
-                self.process_list.append(pid)
+            except Exception as e:
+                # 退出码非0，父进程据此把它计为崩溃
+                logging.error(u"子进程执行异常[%s]" % e)
+                sys.exit(1)
+        else:  # 父进程
+            self.process_list.append(pid)
+            self._started_at[pid] = time.time()
+            return pid
 
-    def check_alive(self):
+    def check_alive(self, timeout=None):
         """
-        如果进程异常死亡，则重新启动一个加入进程池，并做一些后续处理
-        :return:
+        一次性回收所有已退出的子进程，只补齐缺少的子进程；连续崩溃时按指数退避延迟补齐。
+        没有子进程退出时阻塞等待SIGCHLD，不会因为单个子进程而反复fork整个进程池
+        :param timeout: 没有子进程退出时最多等待的时间(秒)，None表示一直等待
+        :return: 本次回收的子进程退出状态 [(pid, status)]
         """
         try:
-            exit_stat = None
-            try:
-                # Wait for completion of a child process, and return a tuple
-                # containing its pid and exit status indication
-                exit_stat = os.wait()
-            except OSError as e:
-                self.create_pool()
-                return None
-            logging.info(u"进程退出[%s]" % str(exit_stat))
-            print exit_stat
-            self.process_list.remove(exit_stat[0])
-            pid = os.fork()
-            if pid == 0:  # 子进程
-                try:
-                    if self.args is None:
-                        self.sub_func()
-                    else:
-                        self.sub_func(self.args)
-                    sys.exit()
-                except Exception as e:
-                    sys.exit()
-            else:
-                self.process_list.append(pid)
+            _watch_sigchld(self._wake_w)
+            exited = self._reap_children()
+            if not exited:
+                if len(self.process_list) < self.proc_num:
+                    wait = self._backoff.remaining()
+                    if timeout is not None:
+                        wait = min(wait, timeout)
+                else:
+                    wait = timeout
+                self._wait_sigchld(wait)
+                exited = self._reap_children()
+            if not self._closed and self._backoff.remaining() <= 0:
+                while len(self.process_list) < self.proc_num:
+                    self.create_process()
+                    self._backoff.record_restart()
+            return exited
         except Exception as e:
             logging.error(u"监控子进程失败[%s]" % e)
+            return []
+
+    def _wait_children(self):
+        """
+        阻塞回收sub_func模式下的所有子进程
+        :return:
+        """
+        for pid in list(self.process_list):
+            try:
+                _, status = os.waitpid(pid, 0)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                status = None
+            self.process_list.remove(pid)
+            self._record_exit(pid, status)
+
+    def _reap_children(self):
+        """
+        非阻塞回收sub_func模式下所有已退出的子进程
+        :return: [(pid, status)]
+        """
+        exited = _reap_pids(self.process_list)
+        for pid, status in exited:
+            self.process_list.remove(pid)
+            self._record_exit(pid, status)
+        return exited
+
+    def _wait_sigchld(self, timeout):
+        """
+        等待SIGCHLD写入self-pipe；未能安装信号处理函数时按1秒轮询
+        :param timeout: 等待上限(秒)，None表示一直等待
+        :return:
+        """
+        if not _sigchld_installed[0]:
+            timeout = 1.0 if timeout is None else min(timeout, 1.0)
+        try:
+            readable = select.select([self._wake_r], [], [], timeout)[0]
+        except (select.error, OSError) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            readable = [self._wake_r]
+        if readable:
+            _drain_pipe(self._wake_r)
 
     def reg_signal(self):
         """
@@ -246,6 +2344,220 @@ class WorkProcPoolLinux(object):
         sys.exit()
 
 
+def _copy_future_state(source, target):
+    """
+    将TaskFuture的结果复制到asyncio.Future，在事件循环线程中调用
+    :param source: TaskFuture
+    :param target: asyncio.Future
+    :return:
+    """
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _call_in_loop(loop, callback, *args):
+    """
+    从其他线程把回调投递到事件循环，事件循环已关闭时忽略
+    :param loop:
+    :param callback:
+    :param args:
+    :return:
+    """
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+
+def _link_future(task_future, loop, target=None):
+    """
+    把TaskFuture桥接为asyncio.Future：结果通过call_soon_threadsafe回到事件循环，
+    asyncio侧取消时同步取消尚未开始的任务
+    :param task_future: TaskFuture
+    :param loop:
+    :param target: 已有的asyncio.Future，为None时新建
+    :return: asyncio.Future
+    """
+    if target is None:
+        target = loop.create_future()
+    target.add_done_callback(lambda f: f.cancelled() and task_future.cancel())
+    task_future.add_done_callback(lambda f: _call_in_loop(loop, _copy_future_state, f, target))
+    return target
+
+
+class _AsyncResultIterator(object):
+    """
+    异步结果迭代器：后台线程消费进程池的imap结果，经call_soon_threadsafe送回事件循环；
+    缓冲区满时后台线程阻塞，消费者跟不上时不会在内存中堆积结果
+    """
+
+    def __init__(self, results, loop, buffer_size):
+        self._loop = loop
+        self._items = collections.deque()
+        self._waiter = None
+        self._end = None  # 结束时的(False, 异常)
+        self._slots = threading.Semaphore(buffer_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._feed, args=(results,),
+                                        name='AsyncWorkPoolFeeder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _feed(self, results):
+        """
+        后台线程：逐个取出结果投递到事件循环
+        :param results:
+        :return:
+        """
+        try:
+            for item in results:
+                self._slots.acquire()
+                if self._closed:
+                    break
+                _call_in_loop(self._loop, self._deliver, (True, item))
+            else:
+                _call_in_loop(self._loop, self._deliver, (False, StopAsyncIteration()))
+        except Exception as e:
+            _call_in_loop(self._loop, self._deliver, (False, e))
+        finally:
+            results.close()
+
+    def _deliver(self, entry):
+        if self._waiter is not None and not self._waiter.done():
+            waiter, self._waiter = self._waiter, None
+            self._resolve(waiter, entry)
+        else:
+            self._items.append(entry)
+
+    def _resolve(self, future, entry):
+        ok, value = entry
+        if ok:
+            self._slots.release()
+            future.set_result(value)
+        else:
+            self._end = entry
+            future.set_exception(value)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = self._loop.create_future()
+        if self._end is not None:
+            future.set_exception(StopAsyncIteration())
+        elif self._items:
+            self._resolve(future, self._items.popleft())
+        else:
+            self._waiter = future
+        return future
+
+    def close(self):
+        """
+        提前结束迭代，后台线程停止并取消尚未开始的分块
+        :return:
+        """
+        self._closed = True
+        self._slots.release()
+
+
+class AsyncWorkPool(object):
+    """
+    asyncio门面：把任务提交到进程池/线程池，结果以asyncio.Future返回，不阻塞事件循环。
+
+        pool = AsyncWorkPool(WorkProcPool(8))
+        result = await pool.run(func, x)
+        async for r in pool.map(func, items):
+            ...
+    """
+
+    def __init__(self, pool, loop=None, buffer_size=None):
+        """
+        :param pool: 提供submit/imap/imap_unordered的进程池或线程池(任务分发模式)
+        :param loop: 事件循环，默认使用当前事件循环
+        :param buffer_size: map结果在事件循环侧最多缓冲的条数，默认1024
+        """
+        if asyncio is None:
+            raise RuntimeError(u"AsyncWorkPool需要asyncio(python3.4+)")
+        self.pool = pool
+        self.buffer_size = buffer_size
+        self._loop = loop
+
+    def _get_loop(self):
+        return self._loop if self._loop is not None else asyncio.get_event_loop()
+
+    def run(self, func, *args, **kwargs):
+        """
+        提交任务，返回可await的asyncio.Future。
+        进程池在途任务已满(max_inflight)时，在默认executor中阻塞提交，事件循环不会被阻塞
+        :param func: 需要执行的函数
+        :param args:
+        :param kwargs:
+        :return: asyncio.Future
+        """
+        loop = self._get_loop()
+        submit_nowait = getattr(self.pool, 'submit_nowait', None)
+        if submit_nowait is None:
+            return _link_future(self.pool.submit(func, *args, **kwargs), loop)
+        try:
+            return _link_future(submit_nowait(func, *args, **kwargs), loop)
+        except PoolBusyError:
+            pass
+        target = loop.create_future()
+        submitted = loop.run_in_executor(
+            None, functools.partial(self.pool.submit, func, *args, **kwargs))
+
+        def on_submitted(f):
+            if f.cancelled():
+                target.cancel()
+            elif f.exception() is not None:
+                if not target.done():
+                    target.set_exception(f.exception())
+            else:
+                _link_future(f.result(), loop, target)
+
+        submitted.add_done_callback(on_submitted)
+        return target
+
+    def map(self, func, iterable, chunksize=None, ordered=True):
+        """
+        并行执行func，返回可用async for迭代的结果
+        :param func: 需要执行的函数
+        :param iterable: 输入
+        :param chunksize: 每个任务包含的元素数，None表示自适应
+        :param ordered: True按输入顺序返回，False按完成顺序返回
+        :return: 异步迭代器，提前结束时调用其close()
+        """
+        if ordered:
+            results = self.pool.imap(func, iterable, chunksize)
+        else:
+            results = self.pool.imap_unordered(func, iterable, chunksize)
+        buffer_size = self.buffer_size or 1024
+        return _AsyncResultIterator(results, self._get_loop(), buffer_size)
+
+    def shutdown(self, wait=True):
+        """
+        在默认executor中关闭底层进程池
+        :param wait:
+        :return: asyncio.Future
+        """
+        return self._get_loop().run_in_executor(
+            None, functools.partial(self.pool.shutdown, wait=wait))
+
+    def __aenter__(self):
+        future = self._get_loop().create_future()
+        future.set_result(self)
+        return future
+
+    def __aexit__(self, exc_type, exc_val, exc_tb):
+        return self.shutdown()
+
+
 class WorkProcPool(WorkThreadPoolWindows if os.name == 'nt' else WorkProcPoolLinux):
     """线程/进程池，根据操作系统类型确定具体实现类
     """
@@ -256,8 +2568,8 @@ class WorkProcPool(WorkThreadPoolWindows if os.name == 'nt' else WorkProcPoolLin
 def test(p):
     try:
         time.sleep(1)
-        print p
-    except KeyboardInterrupt, e:
+        print(p)
+    except KeyboardInterrupt as e:
         pass
 
 
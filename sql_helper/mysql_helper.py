@@ -8,7 +8,10 @@ mysql helper: pack some common mysql operating functions
 Authors: changhuan(changhuan1993@gmail.com)
 Date:    2018/7/04
 """
+import os
 import json
+import time
+import threading
 
 import logging
 import MySQLdb
@@ -25,8 +28,10 @@ class MySQL(object):
     _instance = None  # instance of this class
     _conn = None  # connection
     _cur = None  # cursor
+    _cache = None
+    _auto_ping = True  # ping (and reconnect) before every statement, off for pooled connections
 
-    def __init__(self, host, port, user, password, database, charset="utf8"):
+    def __init__(self, host, port, user, password, database, charset="utf8", cache=None):
         """
         Connect to the database based on the parameters.
         :param host:
@@ -35,7 +40,10 @@ class MySQL(object):
         :param password:
         :param database:
         :param charset:
+        :param cache: query_cache.QueryCache for query() results, may be shared by the
+                      instances connected to the same database; writes through them invalidate it
         """
+        self._cache = cache
         try:
             self._conn = MySQLdb.connect(host=host,
                                          port=port,
@@ -56,12 +64,22 @@ class MySQL(object):
         :param sql:
         :return: a list of dict
         """
+        cache_key = None
+        if self._cache is not None:
+            cache_key = self._cache.make_key(sql)
+            if cache_key is not None:
+                hit, result = self._cache.get(cache_key)
+                if hit:
+                    return result
+                version = self._cache.version
         try:
-            self._conn.ping(True)
+            self._ping()
             self._cur = self._conn.cursor(cursorclass=MySQLdb.cursors.DictCursor)
             logging.info('excute query sql：{0}'.format(sql))
             self._cur.execute(sql)
             result = self._cur.fetchall()
+            if cache_key is not None:
+                self._cache.put(cache_key, result, version)
         except MySQLdb.Error as e:
             self._error_code = e.args[0]
             err_msg = "fail to excute query sql，error_code：{0}".format(repr(e))
@@ -77,10 +95,11 @@ class MySQL(object):
         :return: rows affected
         """
         try:
-            self._conn.ping(True)
+            self._ping()
             logging.info('excute update sql：{0}'.format(sql))
             result = self._cur.execute(sql)
             self._conn.commit()
+            self._invalidate(sql)
             return result
         except MySQLdb.Error as e:
             self._error_code = e.args[0]
@@ -98,12 +117,14 @@ class MySQL(object):
         :return: Returns the ID generated for an AUTO_INCREMENT column by the previous query.
         """
         try:
-            self._conn.ping(True)
+            self._ping()
             logging.info("excute inset sql：{0}".format(sql))
             self._cur.execute(sql)
             self._conn.commit()
+            self._invalidate(sql)
             result = self._conn.insert_id()
         except MySQLdb.Error as e:
+            self._error_code = e.args[0]
             err_msg = "fail to excute insert sql，error_code：{0}".format(repr(e))
             logging.error(err_msg)
             self.rollback()
@@ -119,20 +140,55 @@ class MySQL(object):
         :return:
         """
         try:
-            self._conn.ping(True)
+            self._ping()
             self._cur.execute("SET NAMES utf8")
             dict_str = json.dumps(data_dict, encoding='utf8', ensure_ascii=False,
-                                  cls=python.util.formatter.BetterJsonEncoder)
+                                  cls=util.formatter.BetterJsonEncoder)
             logging.info("excute insert dict sql：{0}, dict：{1}".format(sql, dict_str))
             self._cur.execute(sql, data_dict.values())
             self._conn.commit()
+            self._invalidate(sql)
             return True
         except MySQLdb.Error as e:
+            self._error_code = e.args[0]
             err_msg = "fail to excute insert dict sql，error_code：{0}".format(repr(e))
             logging.error(err_msg)
             self.rollback()
             return False
 
+    @classmethod
+    def from_connection(cls, conn, cache=None):
+        """
+        wrap an open MySQLdb connection, e.g. one managed by MySQLPool, which checks its health
+        :param conn: MySQLdb connection
+        :param cache: query_cache.QueryCache
+        :return: MySQL
+        """
+        helper = cls.__new__(cls)
+        helper._conn = conn
+        helper._cur = conn.cursor()
+        helper._cache = cache
+        helper._auto_ping = False
+        helper._instance = MySQLdb
+        return helper
+
+    def _ping(self):
+        """
+        check the connection before a statement, reconnect if it was lost
+        :return:
+        """
+        if self._auto_ping:
+            self._conn.ping(True)
+
+    def _invalidate(self, sql):
+        """
+        drop the cached results a committed write sql may have made stale
+        :param sql:
+        :return:
+        """
+        if self._cache is not None:
+            self._cache.invalidate_sql(sql)
+
     def fetch_all_rows(self):
         """
         return all result rows.
@@ -190,3 +246,414 @@ class MySQL(object):
         """
         self.__del__()
 
+
+class MySQLPoolTimeoutError(Exception):
+    """
+    no connection of MySQLPool became free within checkout_timeout
+    """
+
+
+# client errors meaning the connection is unusable: server gone away, lost connection, ...
+_CONNECTION_ERRORS = (2002, 2003, 2006, 2013, 2055)
+# serialises resetting the pools in a forked child
+_fork_lock = threading.Lock()
+
+
+class _PooledConnection(object):
+    """
+    a connection of MySQLPool and the MySQL helper bound to it
+    """
+
+    def __init__(self, helper):
+        self.helper = helper
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.last_checked = self.created_at  # last successful ping by the health check
+        self.last_thread = None  # ident of the thread that used it last
+        self.depth = 0  # nested checkouts by the owning thread
+        self.pid = os.getpid()  # process that opened it
+
+
+class MySQLPool(object):
+    """
+    pool of MySQL connections shared by threads.
+    a thread gets back the connection it used last when that one is free, and nested checkouts
+    of a thread share one connection. connections are pinged by a background thread while idle,
+    never before a statement; idle connections above min_size are closed after idle_timeout.
+    a process forked from the owner (e.g. a WorkProcPoolLinux worker) opens its own connections
+    on first use, the inherited ones belong to the parent and are left alone.
+
+        pool = MySQLPool(host, port, user, password, database, min_size=2, max_size=20)
+        rows = pool.query(sql)
+        with pool.connection() as db:  # MySQL
+            db.update(sql)
+            db.insert(sql)
+    """
+
+    def __init__(self, host, port, user, password, database, charset="utf8", min_size=1,
+                 max_size=10, checkout_timeout=30.0, idle_timeout=300.0,
+                 health_check_interval=30.0, cache=None):
+        """
+        :param host:
+        :param port:
+        :param user:
+        :param password:
+        :param database:
+        :param charset:
+        :param min_size: connections opened at start and kept open
+        :param max_size: max open connections
+        :param checkout_timeout: seconds to wait for a free connection, None: forever
+        :param health_check_interval: idle connections unused for longer are pinged this often
+        :param idle_timeout: seconds an idle connection above min_size is kept
+        :param cache: query_cache.QueryCache shared by all the connections
+        """
+        self._connect_args = dict(host=host, port=port, user=user, passwd=password, db=database,
+                                  charset=charset)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._cache = cache
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = []  # _PooledConnection, most recently used last
+        self._size = 0  # open connections, idle or checked out
+        self._closed = False
+        self._local = threading.local()
+        self._pid = os.getpid()
+        # connections inherited from the parent process, referenced so they are never closed
+        # (and their sockets shut down under the parent) by the GC
+        self._inherited = []
+        self.stats = {'created': 0, 'discarded': 0, 'evicted': 0, 'checkouts': 0, 'waits': 0,
+                      'timeouts': 0}
+        for _ in range(min_size):
+            pooled = self._connect()
+            if pooled is not None:
+                self._idle.append(pooled)
+                self._size += 1
+        self._start_checker()
+
+    def _start_checker(self):
+        """
+        start the background health check thread
+        :return:
+        """
+        self._stop = threading.Event()
+        self._checker = threading.Thread(target=self._check_loop, name='mysql-pool-checker')
+        self._checker.daemon = True
+        self._checker.start()
+
+    def _check_fork(self):
+        """
+        after a fork, forget the parent's connections and health check thread: the child
+        starts with an empty pool of its own
+        :return:
+        """
+        if self._pid == os.getpid():
+            return
+        with _fork_lock:
+            if self._pid == os.getpid():
+                return
+            # the lock may have been held by another thread of the parent at fork time
+            self._lock = threading.Condition(threading.Lock())
+            self._inherited.extend(self._idle)
+            local_pooled = getattr(self._local, 'pooled', None)
+            if local_pooled is not None:
+                self._inherited.append(local_pooled)
+            self._idle = []
+            self._size = 0
+            self._local = threading.local()
+            logging.info('mysql pool: forked from {0}, drop {1} inherited connections'.format(
+                self._pid, len(self._inherited)))
+            self._pid = os.getpid()
+            if not self._closed:
+                self._start_checker()
+
+    def _connect(self):
+        """
+        open a new connection
+        :return: _PooledConnection, None on error
+        """
+        try:
+            conn = MySQLdb.connect(**self._connect_args)
+            # no statement is left in an open transaction (and an old snapshot) when the
+            # connection goes back to the pool; the helpers still commit their writes
+            conn.autocommit(True)
+        except MySQLdb.Error as e:
+            error_msg = "fail to connect Mysql database，error_code：{0}.".format(repr(e))
+            logging.error(error_msg)
+            return None
+        self.stats['created'] += 1
+        return _PooledConnection(MySQL.from_connection(conn, self._cache))
+
+    def checkout(self, verify=False):
+        """
+        take a connection, waiting up to checkout_timeout when all max_size are in use
+        :param verify: ping an idle connection before handing it out, discard it if broken
+        :return: _PooledConnection, give it back with checkin()
+        """
+        self._check_fork()
+        pooled = getattr(self._local, 'pooled', None)
+        if pooled is not None:
+            pooled.depth += 1
+            return pooled
+        while True:
+            pooled, fresh = self._take()
+            if not verify or fresh:
+                break
+            try:
+                pooled.helper._conn.ping()
+                break
+            except MySQLdb.Error as e:
+                logging.info('discard broken mysql connection: {0}'.format(repr(e)))
+                self._discard(pooled)
+        pooled.depth = 1
+        self._local.pooled = pooled
+        return pooled
+
+    def _take(self):
+        """
+        take an idle connection, preferring the one this thread used last, or open a new one
+        :return: (_PooledConnection, whether it was newly opened)
+        """
+        ident = threading.current_thread().ident
+        pooled = None
+        deadline = None if self.checkout_timeout is None else time.time() + self.checkout_timeout
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise RuntimeError('MySQLPool is closed')
+                if self._idle:
+                    pooled = self._idle.pop()
+                    for index, candidate in enumerate(self._idle):
+                        if candidate.last_thread == ident:
+                            self._idle[index], pooled = pooled, candidate
+                            break
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise MySQLPoolTimeoutError(
+                        'no free connection in {0}s, max_size: {1}'.format(
+                            self.checkout_timeout, self.max_size))
+                self.stats['waits'] += 1
+                self._lock.wait(remaining)
+            self.stats['checkouts'] += 1
+        fresh = pooled is None
+        if fresh:
+            # connect outside the lock, the slot is already reserved
+            pooled = self._connect()
+            if pooled is None:
+                with self._lock:
+                    self._size -= 1
+                    self._lock.notify()
+                raise MySQLdb.OperationalError(2003, 'fail to connect Mysql database')
+        pooled.last_thread = ident
+        return pooled, fresh
+
+    def _discard(self, pooled):
+        """
+        close a connection taken out of the pool and free its slot
+        :param pooled:
+        :return:
+        """
+        with self._lock:
+            self._size -= 1
+            self.stats['discarded'] += 1
+            self._lock.notify()
+        pooled.helper.close()
+
+    def checkin(self, pooled, broken=False):
+        """
+        give a connection back
+        :param pooled: from checkout()
+        :param broken: the connection is unusable, close it instead
+        :return:
+        """
+        if pooled.pid != os.getpid():
+            # checked out in the parent before the fork, it isn't this process's to return
+            return
+        pooled.depth -= 1
+        if pooled.depth > 0 and not broken:
+            return
+        pooled.depth = 0
+        self._local.pooled = None
+        pooled.last_used = time.time()
+        with self._lock:
+            if broken or self._closed:
+                self._size -= 1
+                if broken:
+                    self.stats['discarded'] += 1
+            else:
+                self._idle.append(pooled)
+            self._lock.notify()
+        if broken or self._closed:
+            pooled.helper.close()
+
+    def connection(self):
+        """
+        with pool.connection() as db: ... checks a MySQL helper out for the block
+        :return: context manager
+        """
+        return _Checkout(self)
+
+    def _call(self, method, sql, *args):
+        """
+        run a MySQL method on a pooled connection; a connection found broken is discarded and
+        a query (only reads, writes may already have been applied) is retried once on another
+        :param method: name of the MySQL method
+        :param sql:
+        :return: the method's result
+        """
+        attempts = 2 if method == 'query' else 1
+        retry = False
+        while True:
+            attempts -= 1
+            # the other idle connections were likely lost together with the broken one
+            pooled = self.checkout(verify=retry)
+            helper = pooled.helper
+            helper._error_code = ''
+            broken = False
+            try:
+                result = getattr(helper, method)(sql, *args)
+                broken = helper._error_code in _CONNECTION_ERRORS
+            except Exception:
+                broken = True
+                raise
+            finally:
+                # a nested call can't drop the connection its caller is still using
+                self.checkin(pooled, broken and pooled.depth == 1)
+            if not broken or attempts <= 0 or pooled.depth:
+                return result
+            retry = True
+            logging.info('mysql connection lost, retry {0} on another connection'.format(method))
+
+    def query(self, sql):
+        return self._call('query', sql)
+
+    def update(self, sql):
+        return self._call('update', sql)
+
+    def insert(self, sql):
+        return self._call('insert', sql)
+
+    def insert_dict(self, sql, data_dict):
+        return self._call('insert_dict', sql, data_dict)
+
+    def _check_loop(self):
+        """
+        background thread: ping idle connections, close the ones idle too long, keep min_size
+        :return:
+        """
+        interval = min(self.health_check_interval, self.idle_timeout) / 2.0
+        while not self._stop.wait(max(interval, 0.01)):
+            self._check_idle()
+
+    def _check_idle(self):
+        """
+        one round of the background health check
+        :return:
+        """
+        now = time.time()
+        to_ping = []
+        to_close = []
+        with self._lock:
+            keep = []
+            for pooled in self._idle:
+                if now - pooled.last_used >= self.idle_timeout and self._size > self.min_size:
+                    self._size -= 1
+                    to_close.append(pooled)
+                elif now - max(pooled.last_used, pooled.last_checked) >= \
+                        self.health_check_interval:
+                    to_ping.append(pooled)
+                else:
+                    keep.append(pooled)
+            self._idle = keep
+        for pooled in to_close:
+            self.stats['evicted'] += 1
+            pooled.helper.close()
+        for pooled in to_ping:
+            try:
+                pooled.helper._conn.ping()
+                pooled.last_checked = time.time()
+                self._return_idle(pooled)
+            except MySQLdb.Error as e:
+                logging.info('discard broken idle mysql connection: {0}'.format(repr(e)))
+                self._discard(pooled)
+        with self._lock:
+            missing = 0 if self._closed else max(0, self.min_size - self._size)
+            self._size += missing
+        for _ in range(missing):
+            pooled = self._connect()
+            if pooled is None:
+                with self._lock:
+                    self._size -= 1
+                continue
+            self._return_idle(pooled)
+
+    def _return_idle(self, pooled):
+        """
+        put a connection checked by the health check back, oldest first so it is used last
+        :param pooled:
+        :return:
+        """
+        with self._lock:
+            if self._closed:
+                self._size -= 1
+            else:
+                self._idle.insert(0, pooled)
+                self._lock.notify()
+                return
+        pooled.helper.close()
+
+    def size(self):
+        """
+        :return: (open connections, idle connections)
+        """
+        self._check_fork()
+        with self._lock:
+            return self._size, len(self._idle)
+
+    def close(self):
+        """
+        close the idle connections now and the checked out ones when they come back
+        :return:
+        """
+        self._check_fork()
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._lock.notify_all()
+        self._stop.set()
+        if self._checker is not threading.current_thread():
+            self._checker.join()
+        for pooled in idle:
+            pooled.helper.close()
+
+
+class _Checkout(object):
+    """
+    context manager of MySQLPool.connection()
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._pooled = None
+
+    def __enter__(self):
+        self._pooled = self._pool.checkout()
+        self._pooled.helper._error_code = ''
+        return self._pooled.helper
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pooled, self._pooled = self._pooled, None
+        broken = pooled.helper._error_code in _CONNECTION_ERRORS and pooled.depth == 1
+        self._pool.checkin(pooled, broken)
+        return False
+
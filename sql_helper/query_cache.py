@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+#
+
+"""
+query cache: LRU/TTL cache of query results with table-level invalidation,
+shared by SqliteHelper and MySQL
+"""
+import re
+import time
+import logging
+import threading
+import collections
+
+# a quoted literal or identifier (group 1), kept as is, or a run of whitespace
+_SPACE_RE = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)|\s+""", re.S)
+_WORD_RE = re.compile(r'\w+')
+# [schema.]table, each part optionally quoted
+_IDENT = r'((?:[`"\[]?\w+[`"\]]?\s*\.\s*)?[`"\[]?\w+[`"\]]?)'
+# statements whose target table is known; group 1 is the table
+_WRITE_RES = [re.compile(pattern, re.I) for pattern in (
+    r'^(?:insert|replace)(?:\s+or\s+\w+)?\s+into\s+' + _IDENT,
+    r'^update(?:\s+or\s+\w+)?\s+(?:low_priority\s+|ignore\s+)*' + _IDENT,
+    r'^delete\s+(?:low_priority\s+|quick\s+|ignore\s+)*from\s+' + _IDENT,
+    r'^truncate(?:\s+table)?\s+' + _IDENT,
+    r'^(?:drop|alter)\s+table(?:\s+if\s+exists)?\s+' + _IDENT,
+)]
+# statements that can't make a cached result stale
+_NO_DATA_CHANGE_RE = re.compile(r'^(?:create|begin|commit|analyze|explain)\b', re.I)
+
+
+def normalize_sql(sql):
+    """
+    collapse whitespace outside quoted literals and drop the trailing semicolon,
+    so formatting doesn't split cache keys
+    :param sql:
+    :return:
+    """
+    return _SPACE_RE.sub(lambda match: match.group(1) or ' ', sql).strip().rstrip(';').rstrip()
+
+
+def write_tables(sql):
+    """
+    tables a write statement changes
+    :param sql:
+    :return: set of lower case table names; empty set: no data changed;
+             None: unknown, everything has to be invalidated
+    """
+    sql = normalize_sql(sql)
+    for pattern in _WRITE_RES:
+        match = pattern.match(sql)
+        if match:
+            # db.table -> table
+            return set([match.group(1).split('.')[-1].strip(' `"[]').lower()])
+    if _NO_DATA_CHANGE_RE.match(sql):
+        return set()
+    return None
+
+
+class QueryCache(object):
+    """
+    LRU cache of query results, keyed on the normalised sql and params.
+    an entry is dropped when any table it may read from (any word of its sql) is written through
+    a helper using the cache, or after ttl seconds. writes made by other connections or
+    processes, triggers and cascades are not seen: use ttl for them.
+    cached results are shared between callers and must be treated as read only.
+    thread safe, one cache can be shared by the helpers of the same database.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        """
+        :param max_size: max number of cached results
+        :param ttl: seconds a result stays valid, None: until invalidated or evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (result, expires_at, words)
+        self._by_word = collections.defaultdict(set)  # word of the sql -> keys
+        # bumped by every invalidation: a result read before it may already be stale
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(sql, params=None, row_format=None):
+        """
+        cache key of a query
+        :param sql:
+        :param params: sequence or dict
+        :param row_format: results in different formats are cached apart
+        :return: key, None if the query is not cacheable (not a SELECT, or unhashable params)
+        """
+        sql = normalize_sql(sql)
+        head = sql[:7].lower()
+        if not (head.startswith('select') or head.startswith('with')):
+            return None
+        if params is None:
+            params = ()
+        elif isinstance(params, dict):
+            params = tuple(sorted(params.items()))
+        else:
+            params = tuple(params)
+        key = (sql, params, row_format)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key):
+        """
+        :param key: from make_key
+        :return: (hit, result)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            # most recently used at the end
+            del self._entries[key]
+            self._entries[key] = entry
+            self.hits += 1
+            return True, entry[0]
+
+    def put(self, key, result, version=None):
+        """
+        :param key: from make_key
+        :param result: query result
+        :param version: self.version read before the query ran; the result isn't cached
+                        if an invalidation happened since
+        :return:
+        """
+        words = frozenset(word.lower() for word in _WORD_RE.findall(key[0]))
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, expires_at, words)
+            for word in words:
+                self._by_word[word].add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        """
+        drop an entry, caller holds self._lock
+        :param key:
+        :return:
+        """
+        _, _, words = self._entries.pop(key)
+        for word in words:
+            keys = self._by_word.get(word)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_word[word]
+
+    def invalidate(self, tables):
+        """
+        drop the results that may read from the tables
+        :param tables: iterable of table names, None: everything
+        :return:
+        """
+        with self._lock:
+            self.version += 1
+            if tables is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                self._by_word.clear()
+                return
+            for table in tables:
+                for key in list(self._by_word.get(table.lower(), ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def invalidate_sql(self, sql):
+        """
+        drop the results a write statement may make stale
+        :param sql:
+        :return:
+        """
+        tables = write_tables(sql)
+        if tables is None:
+            logging.info('query cache: unknown write target, clear all: {0}'.format(sql))
+        if tables is None or tables:
+            self.invalidate(tables)
+
+    def clear(self):
+        self.invalidate(None)
+
+    def stats(self):
+        """
+        :return: dict of hits, misses, hit_ratio, evictions, invalidations, size
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / total if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+            }
@@ -8,8 +8,150 @@ sqlite helper: pack some common sqlite operating functions
 Authors: changhuan(changhuan1993@gmail.com)
 Date:    2018/7/04
 """
+import io
+import sys
+import csv
 import sqlite3
 import logging
+import time
+import itertools
+import threading
+import collections
+
+from sql_helper.query_cache import write_tables
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import asyncio
+except ImportError:  # python2
+    asyncio = None
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+# INSERT ... ON CONFLICT DO UPDATE is available since sqlite 3.24.0
+NATIVE_UPSERT = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+ROW_FORMATS = ('dict', 'tuple', 'row', 'namedtuple')
+
+# pragmas applied at connect time, in this order: page_size has to be set before the
+# database switches to WAL, it only takes effect on a new database or after VACUUM
+PRAGMA_ORDER = ('page_size', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size',
+                'temp_store')
+
+# bulk_load: few fsyncs and big caches, a crash may lose the last transactions (not corrupt)
+# read_heavy: WAL readers don't block on the writer, reads go through mmap
+# durable: every commit is synced to disk
+PROFILES = {
+    'bulk_load': {
+        'page_size': 65536,
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'mmap_size': 256 << 20,
+        'cache_size': -(256 << 10),  # negative: in KiB
+        'temp_store': 'MEMORY',
+    },
+    'read_heavy': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 1 << 30,
+        'cache_size': -(128 << 10),
+        'temp_store': 'MEMORY',
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -(16 << 10),
+    },
+}
+
+
+class _DictRowFactory(object):
+    """
+    make row return in dictionary form, column names are computed once per result set
+    instead of once per row
+    """
+
+    def __init__(self):
+        self._description = None
+        self._names = ()
+
+    def __call__(self, cursor, row):
+        if cursor.description is not self._description:
+            self._description = cursor.description
+            self._names = [col[0] for col in self._description]
+        return dict(zip(self._names, row))
+
+
+class _NamedTupleRowFactory(object):
+    """
+    make row return as a namedtuple, the class is cached per set of column names
+    """
+    MAX_CLASSES = 256
+
+    def __init__(self):
+        self._description = None
+        self._cls = None
+        self._classes = {}  # column names -> namedtuple class
+
+    def __call__(self, cursor, row):
+        if cursor.description is not self._description:
+            self._description = cursor.description
+            names = tuple(col[0] for col in self._description)
+            cls = self._classes.get(names)
+            if cls is None:
+                if len(self._classes) >= self.MAX_CLASSES:
+                    self._classes.clear()
+                # rename=True: columns like count(*) are not valid field names
+                cls = self._classes[names] = collections.namedtuple('Row', names, rename=True)
+            self._cls = cls
+        return self._cls._make(row)
+
+
+def _make_row_factory(row_format):
+    """
+    row_factory of a row format
+    :param row_format: one of ROW_FORMATS
+    :return:
+    """
+    if row_format == 'dict':
+        return _DictRowFactory()
+    if row_format == 'tuple':
+        return None
+    if row_format == 'row':
+        return sqlite3.Row
+    if row_format == 'namedtuple':
+        return _NamedTupleRowFactory()
+    raise ValueError('unknown row_format: {0}, expect one of {1}'.format(row_format, ROW_FORMATS))
+
+
+def _project_dicts(rows, fields_list, strict):
+    """
+    dict rows -> lists of their fields_list values
+    :param rows: iterable of dict
+    :param fields_list:
+    :param strict: also reject rows with keys not in fields_list
+    :return: generator, raises ValueError on a row that doesn't match
+    """
+    for row in rows:
+        try:
+            values = [row[key] for key in fields_list]
+        except KeyError as e:
+            raise ValueError('row without column {0}: {1}'.format(e, sorted(row)))
+        if strict and len(row) != len(values):
+            raise ValueError('row with columns {0}, expect {1}'.format(sorted(row), fields_list))
+        yield values
 
 
 class SqliteHelper(object):
@@ -22,45 +164,124 @@ class SqliteHelper(object):
     _conn = None
     _cur = None
 
-    def __init__(self, db_path):
+    def __init__(self, db_path, cached_statements=256, row_format='dict', profile=None,
+                 pragmas=None, check_same_thread=True, cache=None):
         """
         Connect to the database based on db3 path.
         :param db_path: sqlite db3 path
+        :param cached_statements: size of sqlite3's prepared statement cache
+        :param row_format: form of returned rows, 'dict', 'tuple', 'row' (sqlite3.Row) or
+                           'namedtuple'; tuple and sqlite3.Row are built in C and the fastest
+        :param profile: None (sqlite defaults), 'bulk_load', 'read_heavy' or 'durable', see PROFILES
+        :param pragmas: dict of PRAGMA_ORDER name -> value, overrides the profile
+        :param check_same_thread: False: the connection may be used (or closed) by another thread
+        :param cache: query_cache.QueryCache for query() results, may be shared by the helpers
+                      of the same database; writes through this helper invalidate it
         """
+        row_factory = _make_row_factory(row_format)
+        if profile is not None and profile not in PROFILES:
+            raise ValueError('unknown profile: {0}, expect one of {1}'.format(
+                profile, sorted(PROFILES)))
+        settings = dict(PROFILES.get(profile, {}))
+        settings.update(pragmas or {})
+        unknown = set(settings) - set(PRAGMA_ORDER)
+        if unknown:
+            raise ValueError('unsupported pragmas: {0}'.format(sorted(unknown)))
+        self.profile = profile
+        self._row_format = row_format
+        self._cache = cache
+        self.settings = {}  # effective values of PRAGMA_ORDER, read back after connecting
+        # (kind, table_name, search_key, fields) -> sql, so dict based writes reuse the same
+        # statement text and hit sqlite3's prepared statement cache
+        self._statement_cache = {}
+        self._unique_keys = {}  # (table_name, search_key) -> whether search_key is unique
+        self._transaction = None  # the active _Transaction, which defers the per-call commits
+        self._in_transaction = False  # whether _begin opened a transaction not yet ended
         try:
-            self._conn = sqlite3.connect(db_path)
+            # autocommit mode: sqlite3's implicit BEGIN only precedes DML, and on python 2 DDL
+            # commits the open transaction, so the transactions are opened by _begin instead
+            self._conn = sqlite3.connect(db_path, cached_statements=cached_statements,
+                                         check_same_thread=check_same_thread,
+                                         isolation_level=None)
         except sqlite3.Error as e:
             self._error_code = e.args[0]
             error_msg = "fail to connect to db3，error_code：{0}.".format(repr(e))
             logging.error(error_msg)
 
-        def dict_factory(cursor, row):
-            """
-            make row return in dictionary form
-            :param cursor:
-            :param row: row in result
-            :return: dict
-            """
-            d = {}
-            for idx, col in enumerate(cursor.description):
-                d[col[0]] = row[idx]
-                # d[col[0]] = str(row[idx]) if isinstance(row[idx], str) else row[idx]
-            return d
-
-        self._conn.row_factory = dict_factory
+        self._conn.row_factory = row_factory
         self._cur = self._conn.cursor()
         self._instance = sqlite3
+        self._apply_pragmas(settings)
+
+    def _apply_pragmas(self, settings):
+        """
+        apply the pragmas in PRAGMA_ORDER, then read back and log the effective settings,
+        sqlite silently keeps the old value when one can't be applied (e.g. WAL on :memory:)
+        :param settings: dict of pragma name -> value
+        :return:
+        """
+        cursor = self._cursor('tuple')
+        try:
+            for name in PRAGMA_ORDER:
+                if name in settings:
+                    cursor.execute('PRAGMA {0} = {1}'.format(name, settings[name]))
+                    cursor.fetchall()
+            self.settings = self.get_settings()
+        except sqlite3.Error as e:
+            self._error_code = e.args[0]
+            err_msg = "fail to apply pragmas {0}, error_code：{1}".format(settings, repr(e))
+            logging.error(err_msg)
+        logging.info('sqlite profile: {0}, settings: {1}'.format(self.profile, self.settings))
+
+    def get_settings(self):
+        """
+        effective values of the pragmas in PRAGMA_ORDER
+        :return: dict
+        """
+        cursor = self._cursor('tuple')
+        settings = {}
+        for name in PRAGMA_ORDER:
+            # some pragmas return no row, e.g. mmap_size on an in-memory database
+            row = cursor.execute('PRAGMA {0}'.format(name)).fetchone()
+            settings[name] = row[0] if row else None
+        return settings
+
+    def _cursor(self, row_format=None):
+        """
+        the shared cursor, or a new one when another row format is asked for
+        :param row_format: None: the helper's row format
+        :return:
+        """
+        if row_format is None:
+            return self._cur
+        cursor = self._conn.cursor()
+        cursor.row_factory = _make_row_factory(row_format)
+        return cursor
 
-    def query(self, sql):
+    def query(self, sql, params=None, row_format=None):
         """
         excute query sql
-        :param sql:
-        :return: return a list of dict
+        :param sql: sql with ? or :name placeholders
+        :param params: sequence or dict bound to the placeholders
+        :param row_format: override the helper's row format for this query
+        :return: return a list of rows, dict by default
         """
+        cache_key = None
+        # reads inside a transaction may see uncommitted writes, they are not cached
+        if self._cache is not None and self._transaction is None:
+            cache_key = self._cache.make_key(sql, params, row_format or self._row_format)
+            if cache_key is not None:
+                hit, result = self._cache.get(cache_key)
+                if hit:
+                    return result
+                version = self._cache.version
         try:
-            logging.info('excute query sql：{0}'.format(sql))
-            self._cur.execute(sql)
-            result = self._cur.fetchall()
+            logging.info('excute query sql：{0}, params: {1}'.format(sql, params))
+            cursor = self._cursor(row_format)
+            cursor.execute(sql, params or ())
+            result = cursor.fetchall()
+            if cache_key is not None:
+                self._cache.put(cache_key, result, version)
         except sqlite3.Error as e:
             self._error_code = e.args[0]
             err_msg = "fail to excute query，error_code：{0}".format(repr(e))
@@ -69,25 +290,92 @@ class SqliteHelper(object):
         finally:
             return result
 
-    def update(self, sql):
+    def query_columns(self, sql, params=None, as_numpy=False):
+        """
+        excute query sql and return the result by column, no per-row object is built
+        :param sql: sql with ? or :name placeholders
+        :param params: sequence or dict bound to the placeholders
+        :param as_numpy: True: numpy arrays, False: lists
+        :return: dict of column name -> list or numpy array, None on error
+        """
+        if as_numpy and numpy is None:
+            raise ImportError('numpy is required by query_columns(as_numpy=True)')
+        try:
+            logging.info('excute query_columns sql：{0}, params: {1}'.format(sql, params))
+            cursor = self._cursor('tuple')
+            cursor.execute(sql, params or ())
+            rows = cursor.fetchall()
+            names = [col[0] for col in cursor.description]
+            columns = zip(*rows) if rows else [()] * len(names)
+            convert = numpy.array if as_numpy else list
+            result = dict((name, convert(values)) for name, values in zip(names, columns))
+        except sqlite3.Error as e:
+            self._error_code = e.args[0]
+            err_msg = "fail to excute query_columns，error_code：{0}".format(repr(e))
+            logging.error(err_msg)
+            result = None
+        finally:
+            return result
+
+    def iter_query(self, sql, params=None, batch_size=1000, batches=False, row_format=None):
+        """
+        excute query sql and yield the rows lazily with fetchmany, so memory stays bounded
+        however large the result is. uses its own cursor, other calls may run while iterating.
+        :param sql: sql with ? or :name placeholders
+        :param params: sequence or dict bound to the placeholders
+        :param batch_size: rows fetched per fetchmany
+        :param batches: True: yield lists of up to batch_size rows, False: yield single rows
+        :param row_format: override the helper's row format
+        :return: generator of rows (or of row lists)
+        """
+        logging.info('excute iter_query sql：{0}, params: {1}'.format(sql, params))
+        cursor = self._conn.cursor()
+        if row_format is not None:
+            cursor.row_factory = _make_row_factory(row_format)
+        try:
+            cursor.execute(sql, params or ())
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if batches:
+                    yield rows
+                else:
+                    for row in rows:
+                        yield row
+        except sqlite3.Error as e:
+            # a generator can't return None like query(), stopping silently would truncate the stream
+            self._error_code = e.args[0]
+            err_msg = "fail to excute iter_query，error_code：{0}".format(repr(e))
+            logging.error(err_msg)
+            raise
+        finally:
+            cursor.close()
+
+    def update(self, sql, params=None):
         """
         excute update sql
-        :param sql:
+        :param sql: sql with ? or :name placeholders
+        :param params: sequence or dict bound to the placeholders
         :return: True: success , False: fail
         """
         try:
-            logging.info('excute update sql：{0}'.format(sql))
-            self._cur.execute(sql)
-            self._conn.commit()
+            logging.info('excute update sql：{0}, params: {1}'.format(sql, params))
+            self._begin()
+            self._cur.execute(sql, params or ())
+            self._auto_commit(sql)
             result = True
         except sqlite3.Error as e:
             self._error_code = e.args[0]
             err_msg = "fail to excute update sql, error_code：{0}".format(repr(e))
             logging.error(err_msg)
-            self.rollback()
+            self._write_failed()
             result = False
-        finally:
-            return result
+        except Exception:
+            # not a database error (e.g. bad params), still end the transaction _begin opened
+            self._write_failed()
+            raise
+        return result
 
     def update_dict(self, table_name, search_key, data_dict):
         """
@@ -95,42 +383,40 @@ class SqliteHelper(object):
         :param table_name:
         :param search_key:
         :param data_dict:
-        :return:
+        :return: True: success , False: fail
         """
-        tmp_list = []
-        for key, value in data_dict.iteritems():
-            if isinstance(value, unicode) or isinstance(value, str):
-                tmp_list.append(key + ' = ' + "'{}'".format(value))
-            else:
-                tmp_list.append(key + ' = ' + str(value))
-        fields_str = ', '.join(tmp_list)
-        if isinstance(data_dict[search_key], str):
-            search_key_value = data_dict[search_key]
-        else:
-            search_key_value = str(data_dict[search_key])
-        sql = 'UPDATE `' + table_name + '` SET ' + fields_str + ' WHERE ' + \
-              search_key + ' = ' + search_key_value
-        self.update(sql)
+        fields = tuple(sorted(key for key in data_dict if key != search_key))
+        if not fields:
+            return True
+        sql = self._get_statement('update', table_name, search_key, fields)
+        params = [data_dict[key] for key in fields]
+        params.append(data_dict[search_key])
+        return self.update(sql, params)
 
-    def insert(self, sql):
+    def insert(self, sql, params=None):
         """
         excute update sql
-        :param sql:
+        :param sql: sql with ? or :name placeholders
+        :param params: sequence or dict bound to the placeholders
         :return: True: success , False: fail
         """
         try:
-            logging.info("excute insert sql：{0}".format(sql))
-            self._cur.execute(sql)
-            self._conn.commit()
+            logging.info("excute insert sql：{0}, params: {1}".format(sql, params))
+            self._begin()
+            self._cur.execute(sql, params or ())
+            self._auto_commit(sql)
             result = True
         except sqlite3.Error as e:
             self._error_code = e.args[0]
             err_msg = "执行insert异常，错误：{0}".format(repr(e))
             logging.error(err_msg)
-            self.rollback()
+            self._write_failed()
             result = False
-        finally:
-            return result
+        except Exception:
+            # not a database error (e.g. bad params), still end the transaction _begin opened
+            self._write_failed()
+            raise
+        return result
 
     def insert_dict(self, table_name, search_key, data_dict):
         """
@@ -140,29 +426,140 @@ class SqliteHelper(object):
         :param data_dict:
         :return: True: success , False: fail
         """
-        if isinstance(data_dict[search_key], str):
-            search_key_value = data_dict[search_key]
+        return self.upsert_many(table_name, search_key, [data_dict])
+
+    def upsert_many(self, table_name, search_key, rows):
+        """
+        insert or update dict rows by search_key in one commit.
+        use a single INSERT ... ON CONFLICT DO UPDATE statement when sqlite supports it and
+        search_key is a primary key or has a unique index, otherwise SELECT then UPDATE/INSERT.
+        :param table_name:
+        :param search_key:
+        :param rows: iterable of dict, may be a generator; every row must have search_key
+        :return: True: success , False: fail (a row without search_key fails the whole call)
+        """
+        native = NATIVE_UPSERT and self._is_unique_key(table_name, search_key)
+        try:
+            logging.info('excute upsert_many, table: {0}, search_key: {1}, native: {2}'.format(
+                table_name, search_key, native))
+            self._begin()
+            # consecutive rows with the same columns share one statement
+            for fields, group in itertools.groupby(rows, lambda row: tuple(sorted(row))):
+                if search_key not in fields:
+                    raise ValueError('row without search_key {0}: {1}'.format(
+                        search_key, fields))
+                if native:
+                    sql = self._get_statement('upsert', table_name, search_key, fields)
+                    self._cur.executemany(sql, ([row[key] for key in fields] for row in group))
+                else:
+                    for row in group:
+                        self._upsert_row(table_name, search_key, fields, row)
+            self._auto_commit(table_name=table_name)
+            result = True
+        except sqlite3.Error as e:
+            self._error_code = e.args[0]
+            err_msg = 'fail to excute upsert_many, error_code:{0}'.format(repr(e))
+            logging.error(err_msg)
+            self._write_failed()
+            result = False
+        except ValueError as e:
+            logging.error('fail to excute upsert_many: {0}'.format(e))
+            self._write_failed()
+            result = False
+        except Exception:
+            self._write_failed()
+            raise
+        return result
+
+    def _upsert_row(self, table_name, search_key, fields, row):
+        """
+        upsert one row with SELECT then UPDATE/INSERT, without commit
+        :param table_name:
+        :param search_key:
+        :param fields: sorted tuple of the row's column names
+        :param row:
+        :return:
+        """
+        self._cur.execute(self._get_statement('exists', table_name, search_key, ()),
+                          (row[search_key],))
+        if self._cur.fetchone():
+            update_fields = tuple(key for key in fields if key != search_key)
+            if update_fields:
+                params = [row[key] for key in update_fields]
+                params.append(row[search_key])
+                self._cur.execute(
+                    self._get_statement('update', table_name, search_key, update_fields), params)
         else:
-            search_key_value = str(data_dict[search_key])
-            # search_key_value = set_precision(data_dict[search_key], 6)
-
-        query_str = 'SELECT * FROM `' + table_name + '` WHERE ' + search_key + ' = ' + \
-                    search_key_value
-        query_res = self.query(query_str)
-        # if exist, update
-        if query_res:
-            self.update_dict(table_name, search_key, data_dict)
-        # else, insert
+            self._cur.execute(self._get_statement('insert', table_name, None, fields),
+                              [row[key] for key in fields])
+
+    def _is_unique_key(self, table_name, search_key):
+        """
+        whether search_key alone is the primary key or a unique index of the table,
+        which ON CONFLICT(search_key) requires
+        :param table_name:
+        :param search_key:
+        :return: bool
+        """
+        cache_key = (table_name, search_key)
+        if cache_key in self._unique_keys:
+            return self._unique_keys[cache_key]
+        unique = False
+        cursor = self._cursor('tuple')
+        try:
+            # table_info: (cid, name, type, notnull, dflt_value, pk)
+            columns = cursor.execute('PRAGMA table_info(`{0}`)'.format(table_name)).fetchall()
+            pk_columns = [column[1] for column in columns if column[5]]
+            unique = pk_columns == [search_key]
+            if not unique:
+                # index_list: (seq, name, unique, ...), index_info: (seqno, cid, name)
+                indexes = cursor.execute('PRAGMA index_list(`{0}`)'.format(table_name)).fetchall()
+                for index in indexes:
+                    if not index[2]:
+                        continue
+                    index_columns = cursor.execute(
+                        'PRAGMA index_info(`{0}`)'.format(index[1])).fetchall()
+                    if [column[2] for column in index_columns] == [search_key]:
+                        unique = True
+                        break
+        except sqlite3.Error as e:
+            logging.error('fail to get unique keys of {0}, error_code:{1}'.format(table_name, repr(e)))
+        self._unique_keys[cache_key] = unique
+        return unique
+
+    def _get_statement(self, kind, table_name, search_key, fields):
+        """
+        build the parameterised sql of a statement shape once and reuse it afterwards
+        :param kind: 'exists', 'update', 'insert' or 'upsert'
+        :param table_name:
+        :param search_key:
+        :param fields: sorted tuple of column names
+        :return: sql
+        """
+        cache_key = (kind, table_name, search_key, fields)
+        sql = self._statement_cache.get(cache_key)
+        if sql is not None:
+            return sql
+        if kind == 'exists':
+            sql = 'SELECT 1 FROM `' + table_name + '` WHERE ' + search_key + ' = ? LIMIT 1'
+        elif kind == 'update':
+            sql = 'UPDATE `' + table_name + '` SET ' + \
+                  ', '.join(key + ' = ?' for key in fields) + ' WHERE ' + search_key + ' = ?'
+        elif kind == 'upsert':
+            update_fields = [key for key in fields if key != search_key]
+            sql = 'INSERT INTO `' + table_name + '` (' + ', '.join(fields) + ') VALUES (' + \
+                  ', '.join('?' for _ in fields) + ') ON CONFLICT(' + search_key + ') DO '
+            if update_fields:
+                sql += 'UPDATE SET ' + ', '.join(key + ' = excluded.' + key for key in update_fields)
+            else:
+                sql += 'NOTHING'
+        elif kind == 'insert':
+            sql = 'INSERT INTO `' + table_name + '` (' + ', '.join(fields) + ') VALUES (' + \
+                  ', '.join('?' for _ in fields) + ')'
         else:
-            key_list = []
-            value_list = []
-            for key, value in data_dict.iteritems():
-                key_list.append(key)
-                value_list.append(str(value))
-            key_str = '(' + ', '.join(key_list) + ')'
-            value_str = '(' + ', '.join(value_list) + ')'
-            insert_query = 'INSERT INTO `' + table_name + '` ' + key_str + 'VALUES' + value_str
-            return self.insert(insert_query)
+            raise ValueError('unknown statement kind: {0}'.format(kind))
+        self._statement_cache[cache_key] = sql
+        return sql
 
     def insert_many(self, table_name, data_list, fields_list=None):
         """
@@ -191,35 +588,212 @@ class SqliteHelper(object):
 
         try:
             logging.info('excute insert_many, sql: {}'.format(sql))
+            self._begin()
             self._cur.executemany(sql, data_list)
-            self._conn.commit()
+            self._auto_commit(table_name=table_name)
             result = True
         except sqlite3.Error as e:
             err_msg = 'fail to excute insert_many, error_code:{}'.format(repr(e))
             logging.error(err_msg)
-            self.rollback()
+            self._write_failed()
             result = False
+        except Exception:
+            # not a database error (e.g. bad params), still end the transaction _begin opened
+            self._write_failed()
+            raise
+        return result
+
+    def bulk_load(self, table_name, source, fields_list=None, batch_size=50000,
+                  drop_indexes=False, header=True, delimiter=',', encoding='utf-8'):
+        """
+        stream rows into a table with bounded memory, committing every batch_size rows.
+        :param table_name:
+        :param source: csv file path, numpy structured array, or any iterable (generator) of
+                       sequences or dicts
+        :param fields_list: columns of the rows; defaults to the csv header, the array's field
+                            names or the first dict's keys; None for sequences: all table columns.
+                            dict rows must have all of them; without fields_list, a dict row
+                            with other keys than the first one fails the load
+        :param batch_size: rows per executemany and commit
+        :param drop_indexes: drop the table's non-unique indexes before loading and rebuild
+                             them after, rebuilding once is much faster than updating them per
+                             row; unique indexes are kept so duplicates are still rejected
+        :param header: csv only, whether the first line is the header
+        :param delimiter: csv only
+        :param encoding: csv only
+        :return: dict of ok, rows, batches, seconds, rows_per_sec; ok is False if loading
+                 failed or a dropped index couldn't be rebuilt
+        """
+        start = time.time()
+        stats = {'ok': False, 'rows': 0, 'batches': 0, 'seconds': 0.0, 'rows_per_sec': 0.0}
+        csv_file = None
+        indexes = []
+        try:
+            if isinstance(source, string_types):
+                csv_file, rows = self._open_csv(source, delimiter, encoding)
+                if header:
+                    names = next(rows, None)
+                    fields_list = fields_list or names
+            elif numpy is not None and isinstance(source, numpy.ndarray) and source.dtype.names:
+                fields_list = fields_list or list(source.dtype.names)
+                rows = (row for start_row in range(0, len(source), batch_size)
+                        for row in source[start_row:start_row + batch_size].tolist())
+            else:
+                rows = iter(source)
+            first = next(rows, None)
+            if first is None:
+                logging.info('bulk_load: no rows for {0}'.format(table_name))
+            else:
+                rows = itertools.chain([first], rows)
+                if isinstance(first, dict):
+                    rows = _project_dicts(rows, fields_list or sorted(first), not fields_list)
+                    fields_list = fields_list or sorted(first)
+                if fields_list:
+                    sql = self._get_statement('insert', table_name, None, tuple(fields_list))
+                else:
+                    sql = 'INSERT INTO `' + table_name + '` VALUES (' + \
+                          ', '.join('?' for _ in first) + ')'
+                logging.info('excute bulk_load, sql: {0}'.format(sql))
+
+                if drop_indexes:
+                    indexes = self._drop_indexes(table_name)
+                while True:
+                    batch = list(itertools.islice(rows, batch_size))
+                    if not batch:
+                        break
+                    self._begin()
+                    self._cur.executemany(sql, batch)
+                    self._auto_commit(table_name=table_name)
+                    stats['rows'] += len(batch)
+                    stats['batches'] += 1
+            stats['ok'] = True
+        except sqlite3.Error as e:
+            self._error_code = e.args[0]
+            err_msg = 'fail to excute bulk_load after {0} rows, error_code:{1}'.format(
+                stats['rows'], repr(e))
+            logging.error(err_msg)
+            self._write_failed()
+        except ValueError as e:
+            logging.error('fail to excute bulk_load after {0} rows: {1}'.format(
+                stats['rows'], e))
+            self._write_failed()
+        except Exception:
+            self._write_failed()
+            raise
         finally:
-            return result
+            if csv_file is not None:
+                csv_file.close()
+            if indexes and not self._create_indexes(indexes):
+                stats['ok'] = False
+        stats['seconds'] = time.time() - start
+        stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+        logging.info('bulk_load {0}: {1} rows in {2:.3f}s, {3:.0f} rows/s'.format(
+            table_name, stats['rows'], stats['seconds'], stats['rows_per_sec']))
+        return stats
+
+    @staticmethod
+    def _open_csv(path, delimiter, encoding):
+        """
+        open a csv file for reading
+        :return: (file, iterator of rows)
+        """
+        if sys.version_info[0] < 3:
+            csv_file = open(path, 'rb')
+            reader = csv.reader(csv_file, delimiter=delimiter)
+            # sqlite3 rejects non-ascii byte strings
+            return csv_file, ([value.decode(encoding) for value in row] for row in reader)
+        csv_file = io.open(path, 'r', newline='', encoding=encoding)
+        return csv_file, csv.reader(csv_file, delimiter=delimiter)
+
+    def _drop_indexes(self, table_name):
+        """
+        drop the explicitly created non-unique indexes of a table. unique indexes are kept,
+        without them duplicate rows would load and the rebuild fail; indexes of
+        PRIMARY KEY/UNIQUE constraints can't be dropped anyway
+        :param table_name:
+        :return: [(name, sql)] to rebuild them
+        """
+        cursor = self._cursor('tuple')
+        # index_list: (seq, name, unique, ...)
+        unique = set(index[1] for index in cursor.execute(
+            'PRAGMA index_list(`{0}`)'.format(table_name)).fetchall() if index[2])
+        indexes = [(name, sql) for name, sql in cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+            "AND sql IS NOT NULL", (table_name,)).fetchall() if name not in unique]
+        for name, _ in indexes:
+            logging.info('bulk_load: drop index {0}'.format(name))
+            cursor.execute('DROP INDEX `{0}`'.format(name))
+        return indexes
 
-    def delete(self, sql):
+    def _create_indexes(self, indexes):
+        """
+        rebuild indexes dropped by _drop_indexes
+        :param indexes: [(name, sql)]
+        :return: True: all rebuilt, False: any failed
+        """
+        result = True
+        for name, sql in indexes:
+            try:
+                logging.info('bulk_load: rebuild index {0}'.format(name))
+                self._cur.execute(sql)
+                self._auto_commit()
+            except sqlite3.Error as e:
+                self._error_code = e.args[0]
+                logging.error('fail to rebuild index {0}: {1}, error_code:{2}'.format(
+                    name, sql, repr(e)))
+                self._write_failed()
+                result = False
+        return result
+
+    def execute_many(self, sql, params_list):
+        """
+        excute one parameterised sql for every params in params_list, in one commit.
+        :param sql: sql with ? or :name placeholders
+        :param params_list: iterable of sequences or dicts
+        :return: True: success , False: fail
+        """
+        try:
+            logging.info('excute execute_many, sql: {0}'.format(sql))
+            self._begin()
+            self._cur.executemany(sql, params_list)
+            self._auto_commit(sql)
+            result = True
+        except sqlite3.Error as e:
+            self._error_code = e.args[0]
+            err_msg = 'fail to excute execute_many, error_code:{0}'.format(repr(e))
+            logging.error(err_msg)
+            self._write_failed()
+            result = False
+        except Exception:
+            # not a database error (e.g. bad params), still end the transaction _begin opened
+            self._write_failed()
+            raise
+        return result
+
+    def delete(self, sql, params=None):
         """
         excute delete sql
-        :param sql:
+        :param sql: sql with ? or :name placeholders
+        :param params: sequence or dict bound to the placeholders
         :return:
         """
         try:
-            logging.info('excute delete sql：{0}'.format(sql))
-            self._cur.execute(sql)
-            self._conn.commit()
+            logging.info('excute delete sql：{0}, params: {1}'.format(sql, params))
+            self._begin()
+            self._cur.execute(sql, params or ())
+            self._auto_commit(sql)
             result = True
         except sqlite3.Error as e:
             self._error_code = e.args[0]
             err_msg = "fail to excute delete sql，error_code：{0}".format(repr(e))
             logging.error(err_msg)
+            self._write_failed()
             result = False
-        finally:
-            return result
+        except Exception:
+            # not a database error (e.g. bad params), still end the transaction _begin opened
+            self._write_failed()
+            raise
+        return result
 
     def create_table(self, sql):
         """
@@ -229,16 +803,23 @@ class SqliteHelper(object):
         """
         try:
             logging.info('excute create table sql : {0}'.format(sql))
+            self._begin()
             self._cur.execute(sql)
-            self._conn.commit()
+            self._auto_commit(sql)
+            # the sql may add a primary key or unique index used by upsert_many
+            self._unique_keys.clear()
             result = True
         except sqlite3.Error as e:
             self._error_code = e.args[0]
             err_msg = "fail to create table, error_code: {0}".format(repr(e))
             logging.error(err_msg)
+            self._write_failed()
             result = False
-        finally:
-            return result
+        except Exception:
+            # not a database error (e.g. bad params), still end the transaction _begin opened
+            self._write_failed()
+            raise
+        return result
 
     def truncate_table(self, sql):
         """
@@ -248,16 +829,21 @@ class SqliteHelper(object):
         """
         try:
             logging.info('excute truncate sql: {0}'.format(sql))
+            self._begin()
             self._cur.execute(sql)
-            self._conn.commit()
+            self._auto_commit(sql)
             result = True
         except sqlite3.Error as e:
             self._error_code = e.args[0]
             err_msg = "truncate error: {0}".format(repr(e))
             logging.error(err_msg)
+            self._write_failed()
             result = False
-        finally:
-            return result
+        except Exception:
+            # not a database error (e.g. bad params), still end the transaction _begin opened
+            self._write_failed()
+            raise
+        return result
 
     def get_description(self, table_name):
         """
@@ -313,19 +899,105 @@ class SqliteHelper(object):
         """
         return self._cur.rowcount
 
+    def transaction(self):
+        """
+        run the writes of a with block in one transaction:
+            with helper.transaction() as tx:
+                helper.insert(...)
+                helper.update(...)
+        commit once at exit; if the block raises or any write fails, roll back all of them
+        (DDL included), tx.committed tells which happened. nested calls join the outer transaction.
+        :return: _Transaction
+        """
+        return _Transaction(self)
+
+    def batch(self, size=1000):
+        """
+        like transaction(), but also commit every size write calls, so a long running writer
+        keeps its journal small. after an error no more batches are committed, and at exit
+        the writes since the last commit are rolled back.
+        :param size: write calls per commit
+        :return: _Transaction
+        """
+        return _Transaction(self, size)
+
+    def _auto_commit(self, sql=None, table_name=None):
+        """
+        commit after a successful write call unless a transaction defers it,
+        then invalidate the cached results of the written table
+        :param sql: the write sql, its target table is invalidated
+        :param table_name: the written table, when sql isn't given
+        :return:
+        """
+        if sql is not None:
+            tables = write_tables(sql)
+        elif table_name is not None:
+            tables = set([table_name])
+        else:
+            tables = set()
+        if self._transaction is None:
+            self.commit()
+            self._invalidate(tables)
+        else:
+            self._transaction.statement_done(tables)
+
+    def _invalidate(self, tables):
+        """
+        drop the cached results of the tables
+        :param tables: set of table names, None: all
+        :return:
+        """
+        if self._cache is not None and (tables is None or tables):
+            self._cache.invalidate(tables)
+
+    def _write_failed(self):
+        """
+        roll back after a failed write call; inside a transaction mark it failed instead,
+        so the whole transaction is rolled back at exit
+        :return:
+        """
+        if self._transaction is None:
+            self.rollback()
+        else:
+            self._transaction.failed = True
+
+    def _begin(self):
+        """
+        open a transaction unless one is already open, so all the statements until commit()
+        or rollback(), DDL included, take effect together
+        :return:
+        """
+        if not self._in_transaction:
+            self._conn.execute('BEGIN')
+            self._in_transaction = True
+
     def commit(self):
         """
         commit
         :return:
         """
-        self._conn.commit()
+        if self._in_transaction:
+            try:
+                self._conn.execute('COMMIT')
+            except sqlite3.Error:
+                # e.g. database is locked: the transaction would stay open and be committed
+                # by the next write call, end it here
+                self.rollback()
+                raise
+            self._in_transaction = False
 
     def rollback(self):
         """
         rollback
         :return:
         """
-        self._conn.rollback()
+        if self._in_transaction:
+            self._in_transaction = False
+            try:
+                self._conn.execute('ROLLBACK')
+            except sqlite3.Error as e:
+                # some errors (e.g. SQLITE_FULL) make sqlite roll back by itself
+                logging.info('rollback: {0}'.format(repr(e)))
 
     def __del__(self):
         """
@@ -337,6 +1009,8 @@ class SqliteHelper(object):
                 self._cur.close()
             if self._conn:
                 self._conn.close()
+            self._cur = None
+            self._conn = None
         except Exception as e:
             logging.error("fail to release，error_code：{0}".format(repr(e)))
 
@@ -348,6 +1022,563 @@ class SqliteHelper(object):
         self.__del__()
 
 
+class _Transaction(object):
+    """
+    context manager returned by SqliteHelper.transaction() and SqliteHelper.batch()
+    """
+
+    def __init__(self, helper, size=None):
+        """
+        :param helper: SqliteHelper
+        :param size: commit every size write calls, None: only at exit
+        """
+        self._helper = helper
+        self._outer = None
+        self.size = size
+        self.pending = 0  # write calls since the last commit
+        self.tables = set()  # tables written since the last commit, None: unknown
+        self.commits = 0
+        self.failed = False
+        self.committed = False
+
+    def statement_done(self, tables):
+        """
+        count a successful write call, commit when the batch is full
+        :param tables: tables it wrote, None: unknown
+        :return:
+        """
+        self.pending += 1
+        if tables is None or self.tables is None:
+            self.tables = None
+        else:
+            self.tables.update(tables)
+        if self.size and self.pending >= self.size and not self.failed:
+            self._commit()
+
+    def _commit(self):
+        """
+        commit and invalidate the cached results of the tables written since the last commit
+        :return:
+        """
+        self._helper.commit()
+        self._helper._invalidate(self.tables)
+        self.commits += 1
+        self.pending = 0
+        self.tables = set()
+
+    def __enter__(self):
+        self._outer = self._helper._transaction
+        if self._outer is None:
+            self._helper._begin()
+            self._helper._transaction = self
+            return self
+        return self._outer
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._outer is not None:
+            if exc_type is not None:
+                self._outer.failed = True
+            return False
+        self._helper._transaction = None
+        if exc_type is None and not self.failed:
+            self._commit()
+            self.committed = True
+        else:
+            logging.error('transaction failed, rollback {0} write calls, error: {1}'.format(
+                self.pending, repr(exc_val)))
+            self._helper.rollback()
+        self.pending = 0
+        self.tables = set()
+        return False
+
+
+class WriteTimeoutError(Exception):
+    """
+    a write sent to SqlitePool's writer thread didn't finish in time
+    """
+
+
+class _WriteRequest(object):
+    """
+    a SqliteHelper write call waiting for SqlitePool's writer thread
+    """
+
+    def __init__(self, method, args, kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def run(self, helper):
+        """
+        call the method on the writer's helper, exceptions are kept for the caller
+        :param helper:
+        :return:
+        """
+        try:
+            self._result = getattr(helper, self.method)(*self.args, **self.kwargs)
+        except Exception as e:
+            self._exception = e
+
+    def finish(self):
+        self._event.set()
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """
+        wait until the write is committed (or failed)
+        :param timeout: seconds, None: wait forever
+        :return: the return value of the SqliteHelper method
+        """
+        if not self._event.wait(timeout):
+            raise WriteTimeoutError('{0} not finished in {1}s'.format(self.method, timeout))
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class SqlitePool(object):
+    """
+    share one sqlite database between threads: every thread reads through its own connection,
+    all writes are funnelled through one writer thread, which commits the small writes queued
+    at the same time together. use a file database, each :memory: connection is a separate db.
+    """
+    # small single-statement writes, grouped into one transaction by the writer
+    GROUP_METHODS = ('update', 'update_dict', 'insert', 'insert_dict', 'delete')
+    # all writes, the others (bulk writes and DDL) run and commit on their own
+    WRITE_METHODS = GROUP_METHODS + ('upsert_many', 'insert_many', 'bulk_load', 'execute_many',
+                                     'create_table', 'truncate_table')
+
+    def __init__(self, db_path, profile='read_heavy', group_size=1000, commit_delay=0.0,
+                 queue_size=10000, **helper_kwargs):
+        """
+        :param db_path: sqlite db3 path
+        :param profile: profile of all connections, WAL lets readers run beside the writer
+        :param group_size: max write calls per group commit
+        :param commit_delay: seconds the writer waits for more writes before committing a group
+        :param queue_size: max queued writes, writers block when it is full
+        :param helper_kwargs: other SqliteHelper arguments, e.g. row_format, or a QueryCache
+                              as cache, which is then shared by all the connections
+        """
+        self.db_path = db_path
+        self.group_size = group_size
+        self.commit_delay = commit_delay
+        self._helper_kwargs = dict(helper_kwargs, profile=profile)
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._closed = False
+        self.group_commits = 0
+        self._queue = queue.Queue(queue_size)
+        # created here so bad arguments raise in the caller, used only by the writer thread
+        writer_helper = SqliteHelper(db_path, check_same_thread=False, **self._helper_kwargs)
+        self._writer = threading.Thread(target=self._write_loop, args=(writer_helper,),
+                                        name='sqlite-writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def reader(self):
+        """
+        the read connection of the current thread, created on first use
+        :return: SqliteHelper
+        """
+        if self._closed:
+            raise RuntimeError('SqlitePool is closed')
+        helper = getattr(self._local, 'helper', None)
+        if helper is None:
+            # closed by close() from another thread
+            helper = SqliteHelper(self.db_path, check_same_thread=False, **self._helper_kwargs)
+            self._local.helper = helper
+            with self._readers_lock:
+                self._readers.append(helper)
+        return helper
+
+    def query(self, sql, params=None, row_format=None):
+        return self.reader().query(sql, params, row_format)
+
+    def query_columns(self, sql, params=None, as_numpy=False):
+        return self.reader().query_columns(sql, params, as_numpy)
+
+    def iter_query(self, sql, params=None, batch_size=1000, batches=False, row_format=None):
+        return self.reader().iter_query(sql, params, batch_size, batches, row_format)
+
+    def get_description(self, table_name):
+        return self.reader().get_description(table_name)
+
+    def get_table_names(self):
+        return self.reader().get_table_names()
+
+    def write_nowait(self, method, *args, **kwargs):
+        """
+        queue a SqliteHelper write call for the writer thread
+        :param method: one of WRITE_METHODS
+        :return: _WriteRequest, result() waits for it
+        """
+        if method not in self.WRITE_METHODS:
+            raise ValueError('not a write method: {0}'.format(method))
+        if self._closed:
+            raise RuntimeError('SqlitePool is closed')
+        if not self._writer.is_alive():
+            raise RuntimeError('SqlitePool writer thread is not running')
+        request = _WriteRequest(method, args, kwargs)
+        self._queue.put(request)
+        return request
+
+    def write(self, method, *args, **kwargs):
+        """
+        run a SqliteHelper write call in the writer thread and wait until it is committed
+        :param method: one of WRITE_METHODS
+        :return: the return value of the SqliteHelper method
+        """
+        return self.write_nowait(method, *args, **kwargs).result()
+
+    def _write_loop(self, helper):
+        """
+        writer thread: take the queued writes, run runs of GROUP_METHODS in one transaction
+        :param helper: the writer's SqliteHelper
+        :return:
+        """
+        stop = False
+        while not stop:
+            request = self._queue.get()
+            if request is None:
+                break
+            group = [request]
+            deadline = time.time() + self.commit_delay
+            while len(group) < self.group_size:
+                try:
+                    remaining = deadline - time.time()
+                    if remaining > 0:
+                        request = self._queue.get(timeout=remaining)
+                    else:
+                        request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                group.append(request)
+            try:
+                run = []
+                for request in group:
+                    if request.method in self.GROUP_METHODS:
+                        run.append(request)
+                        continue
+                    self._run_group(helper, run)
+                    run = []
+                    request.run(helper)
+                    request.finish()
+                self._run_group(helper, run)
+            except Exception as e:
+                # the writer must outlive any failure, or every later write would hang
+                logging.error('sqlite writer failed: {0}'.format(repr(e)))
+                helper.rollback()
+                self._fail(group, e)
+        helper.close()
+
+    @staticmethod
+    def _fail(requests, exception):
+        """
+        finish the requests not finished yet with the exception
+        :param requests: [_WriteRequest]
+        :param exception:
+        :return:
+        """
+        for request in requests:
+            if not request.done():
+                request._exception = exception
+                request.finish()
+
+    def _run_group(self, helper, group):
+        """
+        run the writes in one transaction; if any of them fails, roll back and run them
+        one by one, so a bad write doesn't fail the others
+        :param helper: the writer's SqliteHelper
+        :param group: [_WriteRequest]
+        :return:
+        """
+        if len(group) > 1:
+            try:
+                with helper.transaction() as tx:
+                    for request in group:
+                        request.run(helper)
+                        if request._exception is not None:
+                            tx.failed = True
+                            break
+            except sqlite3.Error as e:
+                # the COMMIT failed (e.g. database is locked), the writes are rolled back
+                logging.error('group commit of {0} writes failed: {1}'.format(
+                    len(group), repr(e)))
+                self._fail(group, e)
+                return
+            if tx.committed:
+                self.group_commits += 1
+                for request in group:
+                    request.finish()
+                return
+            logging.info('group commit of {0} writes failed, retry one by one'.format(len(group)))
+        for request in group:
+            request._exception = None
+            request.run(helper)
+            request.finish()
+
+    def close(self, wait=True):
+        """
+        stop the writer after the queued writes and close all connections
+        :param wait: wait for the writer thread to finish
+        :return:
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        if wait:
+            self._writer.join()
+        with self._readers_lock:
+            readers, self._readers = self._readers, []
+        for helper in readers:
+            helper.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def _pool_write_method(name):
+    def method(self, *args, **kwargs):
+        return self.write(name, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = 'SqliteHelper.{0} in the writer thread, wait until committed'.format(name)
+    return method
+
+
+for _name in SqlitePool.WRITE_METHODS:
+    setattr(SqlitePool, _name, _pool_write_method(_name))
+
+
+def _call_in_loop(loop, callback, *args):
+    """
+    schedule a callback in the event loop from another thread, ignored once the loop is closed
+    :param loop:
+    :param callback:
+    :param args:
+    :return:
+    """
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+
+def _set_results(entries):
+    """
+    resolve asyncio futures in the event loop thread
+    :param entries: [(future, ok, result or exception)]
+    :return:
+    """
+    for future, ok, value in entries:
+        if future.done():
+            continue
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+
+class _AsyncRowIterator(object):
+    """
+    async iterator of AsyncSqliteHelper.iter_query: the rows are fetched batch by batch
+    in the executor thread, only one batch is held in memory
+    """
+
+    def __init__(self, owner, sql, params, batch_size, row_format):
+        self._owner = owner
+        self._query = (sql, params, batch_size, True, row_format)
+        self._batches = None  # iter_query generator, only touched in the executor thread
+        self._rows = collections.deque()
+        self._done = False
+
+    def _fetch(self, helper):
+        if self._batches is None:
+            self._batches = helper.iter_query(*self._query)
+        return next(self._batches, [])
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = self._owner._get_loop().create_future()
+        if self._rows:
+            future.set_result(self._rows.popleft())
+            return future
+        if self._done:
+            future.set_exception(StopAsyncIteration())
+            return future
+
+        def on_fetched(fetched):
+            if future.done():
+                return
+            if fetched.cancelled():
+                future.cancel()
+            elif fetched.exception() is not None:
+                self._done = True
+                future.set_exception(fetched.exception())
+            elif not fetched.result():
+                self._done = True
+                future.set_exception(StopAsyncIteration())
+            else:
+                self._rows.extend(fetched.result())
+                future.set_result(self._rows.popleft())
+
+        self._owner.run(self._fetch).add_done_callback(on_fetched)
+        return future
+
+    def close(self):
+        """
+        stop iterating early and release the cursor
+        :return: asyncio.Future
+        """
+        self._done = True
+        self._rows.clear()
+        return self._owner.run(lambda helper: self._batches is not None and self._batches.close())
+
+
+class AsyncSqliteHelper(object):
+    """
+    asyncio facade of SqliteHelper: the methods return awaitable asyncio.Futures and run in
+    one executor thread owning the connection, so the event loop never blocks on sqlite.
+    calls are queued without waiting, the thread runs the queued ones back to back and hands
+    their results to the event loop together.
+
+        db = AsyncSqliteHelper('data.db3')
+        rows = await db.query('SELECT * FROM t WHERE id = ?', (1,))
+        async for row in db.iter_query('SELECT * FROM t'):
+            ...
+        await db.run(lambda helper: ...)  # several calls in a row, e.g. a transaction
+    """
+    METHODS = ('query', 'query_columns', 'update', 'update_dict', 'insert', 'insert_dict',
+               'upsert_many', 'insert_many', 'bulk_load', 'execute_many', 'delete',
+               'create_table', 'truncate_table', 'get_description', 'get_table_names',
+               'get_settings', 'commit', 'rollback')
+
+    def __init__(self, db_path, loop=None, pipeline_depth=64, **helper_kwargs):
+        """
+        :param db_path: sqlite db3 path
+        :param loop: event loop, default: the current event loop
+        :param pipeline_depth: max calls run before their results are handed to the event loop
+        :param helper_kwargs: other SqliteHelper arguments
+        """
+        if asyncio is None:
+            raise RuntimeError('AsyncSqliteHelper requires asyncio (python3.4+)')
+        self._loop = loop
+        self.pipeline_depth = pipeline_depth
+        self._queue = queue.Queue()
+        self._closed = False
+        # created here so bad arguments raise in the caller, used only by the executor thread
+        helper = SqliteHelper(db_path, check_same_thread=False, **helper_kwargs)
+        self._thread = threading.Thread(target=self._run_loop, args=(helper,),
+                                        name='sqlite-async')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _get_loop(self):
+        return self._loop if self._loop is not None else asyncio.get_event_loop()
+
+    def run(self, func, *args, **kwargs):
+        """
+        call func(helper, *args, **kwargs) in the executor thread, no other call runs in between
+        :param func: function taking the SqliteHelper as first argument
+        :return: asyncio.Future of its return value
+        """
+        if self._closed:
+            raise RuntimeError('AsyncSqliteHelper is closed')
+        loop = self._get_loop()
+        future = loop.create_future()
+        self._queue.put((future, loop, func, args, kwargs))
+        return future
+
+    def iter_query(self, sql, params=None, batch_size=1000, row_format=None):
+        """
+        stream the rows of a query, use with async for
+        :param sql: sql with ? or :name placeholders
+        :param params: sequence or dict bound to the placeholders
+        :param batch_size: rows fetched per round trip to the executor thread
+        :param row_format: override the helper's row format
+        :return: async iterator of rows, call its close() when stopping early
+        """
+        return _AsyncRowIterator(self, sql, params, batch_size, row_format)
+
+    def _run_loop(self, helper):
+        """
+        executor thread: run the queued calls, hand each run's results to the event loop at once
+        :param helper:
+        :return:
+        """
+        stop = False
+        while not stop:
+            requests = [self._queue.get()]
+            while len(requests) < self.pipeline_depth:
+                try:
+                    requests.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            results = {}  # loop -> [(future, ok, value)]
+            for request in requests:
+                if request is None:
+                    stop = True
+                    continue
+                future, loop, func, args, kwargs = request
+                if future.cancelled():
+                    continue
+                try:
+                    entry = (future, True, func(helper, *args, **kwargs))
+                except Exception as e:
+                    entry = (future, False, e)
+                results.setdefault(loop, []).append(entry)
+            for loop, entries in results.items():
+                _call_in_loop(loop, _set_results, entries)
+        helper.close()
+
+    def close(self):
+        """
+        close the connection after the queued calls
+        :return: asyncio.Future, done when closed
+        """
+        future = self.run(lambda helper: None)
+        self._closed = True
+        self._queue.put(None)
+        return future
+
+    def __aenter__(self):
+        future = self._get_loop().create_future()
+        future.set_result(self)
+        return future
+
+    def __aexit__(self, exc_type, exc_val, exc_tb):
+        return self.close()
+
+
+def _async_method(name):
+    method_of_helper = getattr(SqliteHelper, name)
+
+    def method(self, *args, **kwargs):
+        return self.run(method_of_helper, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = 'SqliteHelper.{0} in the executor thread, return an asyncio.Future'.format(name)
+    return method
+
+
+for _name in AsyncSqliteHelper.METHODS:
+    setattr(AsyncSqliteHelper, _name, _async_method(_name))
+
+
 def main():
     """
     测试